@@ -0,0 +1,40 @@
+import sqlite3
+
+# Denormalized "author is not banned" flag on posts and comments, with
+# partial indexes over the visible rows only. Index names and WHERE clauses
+# match models.py so create_all() agrees.
+INDEXES = [
+    ("ix_post_visible_created", "post", "created_at"),
+    ("ix_post_visible_category_created", "post", "category, created_at"),
+    ("ix_comment_visible_thread", "comment", "post_id, parent_id, created_at"),
+]
+
+def add_author_visible():
+    conn = sqlite3.connect('instance/forum.db')
+    cursor = conn.cursor()
+
+    for table in ('post', 'comment'):
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'author_visible' not in columns:
+            print(f"Adding author_visible column to {table} table...")
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN author_visible BOOLEAN NOT NULL DEFAULT 1")
+        else:
+            print(f"Column already exists on {table}.")
+
+        # Backfill from the current bans
+        cursor.execute(
+            f"UPDATE {table} SET author_visible = COALESCE("
+            f"(SELECT CASE WHEN u.is_banned THEN 0 ELSE 1 END FROM user u WHERE u.id = {table}.author_id), 1)"
+        )
+        print(f"{cursor.rowcount} {table} rows updated.")
+
+    for name, table, columns in INDEXES:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns}) WHERE author_visible = 1")
+        print(f"Index '{name}' ready.")
+
+    conn.commit()
+    conn.close()
+
+if __name__ == '__main__':
+    add_author_visible()
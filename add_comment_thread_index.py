@@ -0,0 +1,24 @@
+import sqlite3
+
+# Replaces ix_comment_visible_post (post_id, parent_id) with
+# ix_comment_visible_thread (post_id, parent_id, created_at): the comment
+# windows on post_detail page by created_at within one parent, so the
+# index must carry the sort key too.
+
+def add_comment_thread_index():
+    conn = sqlite3.connect('instance/forum.db')
+    cursor = conn.cursor()
+
+    cursor.execute("DROP INDEX IF EXISTS ix_comment_visible_post")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_comment_visible_thread "
+        "ON comment (post_id, parent_id, created_at) WHERE author_visible = 1"
+    )
+    cursor.execute("ANALYZE comment")
+    print("Index 'ix_comment_visible_thread' ready.")
+
+    conn.commit()
+    conn.close()
+
+if __name__ == '__main__':
+    add_comment_thread_index()
@@ -0,0 +1,25 @@
+import sqlite3
+
+# Owner-column indexes used by the KVKK export (kvkk_export.py), named the
+# way SQLAlchemy names index=True columns so create_all() agrees.
+INDEXES = [
+    ("ix_post_author_id", "post", "author_id"),
+    ("ix_comment_author_id", "comment", "author_id"),
+    ("ix_academic_features_user_id", "academic_features", "user_id"),
+    ("ix_post_view_user_id", "post_view", "user_id"),
+    ("ix_report_reporter_id", "report", "reporter_id"),
+]
+
+def add_indexes():
+    conn = sqlite3.connect('instance/forum.db')
+    cursor = conn.cursor()
+
+    for name, table, column in INDEXES:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})")
+        print(f"Index '{name}' ready.")
+
+    conn.commit()
+    conn.close()
+
+if __name__ == '__main__':
+    add_indexes()
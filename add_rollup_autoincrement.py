@@ -0,0 +1,70 @@
+import sqlite3
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateTable, CreateIndex
+from models import PostView, Vote, AcademicFeatures
+
+# Rebuilds the rollup source tables with AUTOINCREMENT ids.
+#
+# analytics.run_rollup() keeps an id watermark per table. Without
+# AUTOINCREMENT SQLite hands out max(id) + 1, so after a vote toggle deletes
+# the newest row a re-cast vote can get an id the rollup has already passed.
+# The sequence is seeded at the watermark so new ids always land above it.
+#
+# Raw sqlite3, no app import: safe to run before the app can start.
+
+MODELS = [PostView, Vote, AcademicFeatures]
+
+def rebuild(cursor, model):
+    table = model.__tablename__
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    row = cursor.fetchone()
+    if row is None:
+        print(f"{table}: no such table, skipped.")
+        return
+    if 'AUTOINCREMENT' in row[0].upper():
+        print(f"{table}: already AUTOINCREMENT.")
+        return
+
+    dialect = sqlite_dialect.dialect()
+    cursor.execute(f"PRAGMA table_info({table})")
+    old_columns = {r[1] for r in cursor.fetchall()}
+    columns = ', '.join(c.name for c in model.__table__.columns if c.name in old_columns)
+
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    # Index names stay with the renamed table until it is dropped
+    cursor.execute(f"SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = '{table}_old' AND sql IS NOT NULL")
+    for (name,) in cursor.fetchall():
+        cursor.execute(f'DROP INDEX "{name}"')
+    cursor.execute(str(CreateTable(model.__table__).compile(dialect=dialect)))
+    cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_old")
+    cursor.execute(f"DROP TABLE {table}_old")
+    for index in model.__table__.indexes:
+        cursor.execute(str(CreateIndex(index).compile(dialect=dialect)))
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE name = 'rollup_watermark'")
+    mark = 0
+    if cursor.fetchone():
+        cursor.execute("SELECT last_id FROM rollup_watermark WHERE source = ?", (table,))
+        mark = (cursor.fetchone() or (0,))[0]
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+    seq = max(mark, cursor.fetchone()[0])
+    cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, seq))
+    print(f"{table}: rebuilt with AUTOINCREMENT, sequence at {seq}.")
+
+def add_rollup_autoincrement():
+    conn = sqlite3.connect('instance/forum.db')
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        for model in MODELS:
+            rebuild(cursor, model)
+        cursor.execute("COMMIT")
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        raise
+    conn.close()
+
+if __name__ == '__main__':
+    add_rollup_autoincrement()
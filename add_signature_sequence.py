@@ -0,0 +1,54 @@
+import sqlite3
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateTable, CreateIndex
+from models import PostSignature
+
+# Rebuilds post_signature with an AUTOINCREMENT id.
+#
+# dedupe.py used to page through the table on (created_at, post_id), but
+# created_at is set by the worker before its commit: a row committed late
+# with an earlier timestamp fell below another worker's watermark and was
+# never loaded there. Ids are handed out under SQLite's write lock, so they
+# follow commit order. Existing rows are numbered in their old order.
+#
+# Raw sqlite3, no app import: safe to run before the app can start.
+
+def add_signature_sequence():
+    conn = sqlite3.connect('instance/forum.db')
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'post_signature'")
+        row = cursor.fetchone()
+        if row is None:
+            print("post_signature: no such table, create_all() will make it.")
+        elif 'AUTOINCREMENT' in row[0].upper():
+            print("post_signature: already has its sequence.")
+        else:
+            dialect = sqlite_dialect.dialect()
+            cursor.execute("ALTER TABLE post_signature RENAME TO post_signature_old")
+            # Index names stay with the renamed table until it is dropped
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                           "AND tbl_name = 'post_signature_old' AND sql IS NOT NULL")
+            for (name,) in cursor.fetchall():
+                cursor.execute(f'DROP INDEX "{name}"')
+            cursor.execute(str(CreateTable(PostSignature.__table__).compile(dialect=dialect)))
+            cursor.execute(
+                "INSERT INTO post_signature (post_id, signature, duplicate_of_id, similarity, created_at) "
+                "SELECT post_id, signature, duplicate_of_id, similarity, created_at FROM post_signature_old "
+                "ORDER BY created_at, post_id"
+            )
+            cursor.execute("DROP TABLE post_signature_old")
+            for index in PostSignature.__table__.indexes:
+                cursor.execute(str(CreateIndex(index).compile(dialect=dialect)))
+            cursor.execute("SELECT COUNT(*) FROM post_signature")
+            print(f"post_signature: rebuilt with AUTOINCREMENT ids, {cursor.fetchone()[0]} rows.")
+        cursor.execute("COMMIT")
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        raise
+    conn.close()
+
+if __name__ == '__main__':
+    add_signature_sequence()
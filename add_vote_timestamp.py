@@ -0,0 +1,25 @@
+from app import create_app, db
+from sqlalchemy import text
+
+app = create_app({'WARM_STARTUP': False})
+
+def add_vote_timestamp_column():
+    with app.app_context():
+        with db.engine.connect() as conn:
+            result = conn.execute(text("PRAGMA table_info(vote)"))
+            columns = [row[1] for row in result]
+
+            if 'timestamp' not in columns:
+                print("Adding timestamp column to vote table...")
+                conn.execute(text("ALTER TABLE vote ADD COLUMN timestamp DATETIME"))
+                conn.commit()
+                print("Column added successfully.")
+            else:
+                print("Column already exists.")
+
+        # Rollup tables (post_stats_hourly, realism_histogram_hourly, rollup_watermark)
+        db.create_all()
+        print("Analytics tables ready.")
+
+if __name__ == "__main__":
+    add_vote_timestamp_column()
@@ -0,0 +1,307 @@
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import text, func
+from models import db, RollupWatermark, PostCategory
+
+# Rows folded per transaction, keeps the SQLite write lock short
+ROLLUP_CHUNK = 50000
+
+# Same text format SQLAlchemy uses for DateTime on SQLite, so ORM filters
+# and raw upserts agree on the bucket key.
+HOUR_BUCKET = "strftime('%Y-%m-%d %H:00:00.000000', {col})"
+
+METRICS = [
+    'views', 'upvotes', 'downvotes',
+    'experience_marks', 'wish_knew_marks',
+    'realism_votes', 'realism_total',
+]
+
+# --------------------
+# INCREMENTAL ROLLUP
+# --------------------
+
+_SOURCES = {
+    'post_view': [f"""
+        INSERT INTO post_stats_hourly (bucket, post_id, category, university, university_id, views,
+            upvotes, downvotes, experience_marks, wish_knew_marks, realism_votes, realism_total)
+        SELECT {HOUR_BUCKET.format(col='COALESCE(src.timestamp, p.created_at)')} AS b,
+               src.post_id, p.category, u.university, u.university_id, COUNT(*), 0, 0, 0, 0, 0, 0
+        FROM post_view src
+        JOIN post p ON p.id = src.post_id
+        JOIN user u ON u.id = p.author_id
+        WHERE src.id > :lo AND src.id <= :hi
+        GROUP BY b, src.post_id
+        ON CONFLICT(bucket, post_id) DO UPDATE SET views = views + excluded.views
+    """],
+    'vote': [f"""
+        INSERT INTO post_stats_hourly (bucket, post_id, category, university, university_id, views,
+            upvotes, downvotes, experience_marks, wish_knew_marks, realism_votes, realism_total)
+        SELECT {HOUR_BUCKET.format(col='COALESCE(src.timestamp, p.created_at)')} AS b,
+               src.post_id, p.category, u.university, u.university_id, 0,
+               SUM(src.value = 1), SUM(src.value = -1), 0, 0, 0, 0
+        FROM vote src
+        JOIN post p ON p.id = src.post_id
+        JOIN user u ON u.id = p.author_id
+        WHERE src.id > :lo AND src.id <= :hi
+        GROUP BY b, src.post_id
+        ON CONFLICT(bucket, post_id) DO UPDATE SET
+            upvotes = upvotes + excluded.upvotes,
+            downvotes = downvotes + excluded.downvotes
+    """],
+    'academic_features': [f"""
+        INSERT INTO post_stats_hourly (bucket, post_id, category, university, university_id, views,
+            upvotes, downvotes, experience_marks, wish_knew_marks, realism_votes, realism_total)
+        SELECT {HOUR_BUCKET.format(col='COALESCE(src.timestamp, p.created_at)')} AS b,
+               src.post_id, p.category, u.university, u.university_id, 0, 0, 0,
+               SUM(src.type = 'is_experience'),
+               SUM(src.type = 'is_wish_knew'),
+               SUM(src.type = 'realism_score'),
+               SUM(CASE WHEN src.type = 'realism_score' THEN src.value ELSE 0 END)
+        FROM academic_features src
+        JOIN post p ON p.id = src.post_id
+        JOIN user u ON u.id = p.author_id
+        WHERE src.id > :lo AND src.id <= :hi
+        GROUP BY b, src.post_id
+        ON CONFLICT(bucket, post_id) DO UPDATE SET
+            experience_marks = experience_marks + excluded.experience_marks,
+            wish_knew_marks = wish_knew_marks + excluded.wish_knew_marks,
+            realism_votes = realism_votes + excluded.realism_votes,
+            realism_total = realism_total + excluded.realism_total
+    """, f"""
+        INSERT INTO realism_histogram_hourly (bucket, post_id, category, university, university_id, score, count)
+        SELECT {HOUR_BUCKET.format(col='COALESCE(src.timestamp, p.created_at)')} AS b,
+               src.post_id, p.category, u.university, u.university_id, src.value, COUNT(*)
+        FROM academic_features src
+        JOIN post p ON p.id = src.post_id
+        JOIN user u ON u.id = p.author_id
+        WHERE src.id > :lo AND src.id <= :hi AND src.type = 'realism_score'
+        GROUP BY b, src.post_id, src.value
+        ON CONFLICT(bucket, post_id, score) DO UPDATE SET count = count + excluded.count
+    """],
+}
+
+
+# Columns the rollup reads that older databases only get from a migration
+REQUIRED_COLUMNS = [
+    ('user', 'university_id', 'migrate_universities.py'),
+    ('vote', 'timestamp', 'add_vote_timestamp.py'),
+]
+
+
+def missing_migrations():
+    """Migration scripts that have to run before run_rollup() can."""
+    with db.engine.connect() as conn:
+        return [script for table, column, script in REQUIRED_COLUMNS
+                if column not in {r[1] for r in conn.execute(text(f"PRAGMA table_info({table})"))}]
+
+
+def run_rollup(chunk=ROLLUP_CHUNK):
+    """
+    Folds raw rows newer than each source's watermark into the rollup tables.
+    Every chunk is one BEGIN IMMEDIATE transaction that reads the watermark,
+    folds the rows and advances it, so concurrent runs (cron and a manual
+    one) serialize instead of folding the same rows twice, and an
+    interrupted run simply resumes. Source ids are AUTOINCREMENT, so a row
+    inserted after a delete never gets an id below the watermark.
+    Returns {source: rows_processed}.
+    """
+    processed = {}
+    for source, statements in _SOURCES.items():
+        total = 0
+        while True:
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                lo = conn.execute(text("SELECT last_id FROM rollup_watermark WHERE source = :source"),
+                                  {'source': source}).scalar()
+                if lo is None:
+                    lo = 0
+                    conn.execute(text(
+                        "INSERT INTO rollup_watermark (source, last_id, updated_at) VALUES (:source, 0, :now)"
+                    ), {'source': source, 'now': _ts(datetime.utcnow())})
+                max_id = conn.execute(text(f"SELECT MAX(id) FROM {source}")).scalar() or 0
+                if lo >= max_id:
+                    conn.commit()
+                    break
+                hi = min(lo + chunk, max_id)
+                for sql in statements:
+                    conn.execute(text(sql), {'lo': lo, 'hi': hi})
+                total += conn.execute(
+                    text(f"SELECT COUNT(*) FROM {source} WHERE id > :lo AND id <= :hi"),
+                    {'lo': lo, 'hi': hi}
+                ).scalar()
+                conn.execute(text(
+                    "UPDATE rollup_watermark SET last_id = :hi, updated_at = :now WHERE source = :source"
+                ), {'hi': hi, 'now': _ts(datetime.utcnow()), 'source': source})
+                conn.commit()
+        processed[source] = total
+    return processed
+
+
+def record_view(post_id):
+    """
+    Adds one view to the current hour bucket. Unique views no longer land in
+    post_view (see viewstore), so they are counted at write time instead.
+    Runs inside the caller's transaction.
+    """
+    db.session.execute(text(f"""
+        INSERT INTO post_stats_hourly (bucket, post_id, category, university, university_id, views,
+            upvotes, downvotes, experience_marks, wish_knew_marks, realism_votes, realism_total)
+        SELECT {HOUR_BUCKET.format(col="'now'")}, p.id, p.category, u.university, u.university_id, 1, 0, 0, 0, 0, 0, 0
+        FROM post p JOIN user u ON u.id = p.author_id
+        WHERE p.id = :pid
+        ON CONFLICT(bucket, post_id) DO UPDATE SET views = views + 1
+    """), {'pid': post_id})
+
+
+# --------------------
+# QUERY API (NumPy)
+# --------------------
+
+def _ts(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _filters(post_id=None, category=None, university_id=None):
+    clauses, params = [], {}
+    if post_id is not None:
+        clauses.append("post_id = :post_id")
+        params['post_id'] = post_id
+    if category is not None:
+        # Post.category is stored by enum name
+        clauses.append("category = :category")
+        params['category'] = category.name if isinstance(category, PostCategory) else category
+    if university_id is not None:
+        clauses.append("university_id = :university_id")
+        params['university_id'] = university_id
+    return clauses, params
+
+
+def _bucket_range(start, end, granularity):
+    if granularity not in ('hour', 'day'):
+        raise ValueError("granularity must be 'hour' or 'day'")
+    unit = 'h' if granularity == 'hour' else 'D'
+    lo = np.datetime64(start, unit)
+    hi = np.datetime64(end, unit)
+    if hi < np.datetime64(end, 'us'):
+        hi += np.timedelta64(1, unit)  # include the partial last bucket
+    return lo, hi, unit
+
+
+def timeseries(metric, start, end, granularity='hour', **filters):
+    """
+    Zero-filled series of a rollup metric between start and end (UTC).
+    metric is one of METRICS or 'realism_average'.
+    Returns (bucket_starts as datetime64 array, values as float array).
+    """
+    if metric != 'realism_average' and metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+
+    lo, hi, unit = _bucket_range(start, end, granularity)
+    clauses, params = _filters(**filters)
+    clauses += ["bucket >= :start", "bucket < :end"]
+    params['start'] = _ts(lo.astype(datetime))
+    params['end'] = _ts(hi.astype(datetime))
+
+    columns = "SUM(realism_total), SUM(realism_votes)" if metric == 'realism_average' else f"SUM({metric})"
+    rows = db.session.execute(text(
+        f"SELECT bucket, {columns} FROM post_stats_hourly "
+        f"WHERE {' AND '.join(clauses)} GROUP BY bucket"
+    ), params).all()
+
+    n = int((hi - lo) / np.timedelta64(1, unit))
+    buckets = lo + np.arange(n) * np.timedelta64(1, unit)
+    if not rows:
+        return buckets, np.zeros(n)
+
+    data = np.array([r[1:] for r in rows], dtype=np.float64)
+    idx = ((np.array([r[0] for r in rows], dtype=f'datetime64[{unit}]') - lo)
+           // np.timedelta64(1, unit)).astype(np.int64)
+
+    if metric == 'realism_average':
+        totals = np.bincount(idx, weights=data[:, 0], minlength=n)
+        votes = np.bincount(idx, weights=data[:, 1], minlength=n)
+        values = np.divide(totals, votes, out=np.zeros(n), where=votes > 0)
+    else:
+        values = np.bincount(idx, weights=data[:, 0], minlength=n)
+    return buckets, values
+
+
+def realism_histogram(start=None, end=None, **filters):
+    """Counts of realism scores 1..10 as an array of length 10."""
+    clauses, params = _filters(**filters)
+    if start is not None:
+        clauses.append("bucket >= :start")
+        params['start'] = _ts(start)
+    if end is not None:
+        clauses.append("bucket < :end")
+        params['end'] = _ts(end)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    rows = db.session.execute(text(
+        f"SELECT score, SUM(count) FROM realism_histogram_hourly {where} GROUP BY score"
+    ), params).all()
+    hist = np.zeros(10, dtype=np.int64)
+    if rows:
+        scores = np.array([r[0] for r in rows], dtype=np.int64)
+        counts = np.array([r[1] for r in rows], dtype=np.int64)
+        valid = (scores >= 1) & (scores <= 10)
+        hist += np.bincount(scores[valid] - 1, weights=counts[valid], minlength=10).astype(np.int64)
+    return hist
+
+
+def totals_by(dimension, start, end):
+    """Metric sums grouped by 'category' or 'university' for a time window."""
+    if dimension not in ('category', 'university'):
+        raise ValueError("dimension must be 'category' or 'university'")
+    if dimension == 'university':
+        # Grouped by the normalized university, not the text as typed
+        select, join, group = "un.name", "LEFT JOIN university un ON un.id = s.university_id", "s.university_id"
+    else:
+        select, join, group = "s.category", "", "s.category"
+    rows = db.session.execute(text(
+        f"SELECT {select}, SUM(s.views), SUM(s.upvotes), SUM(s.downvotes) FROM post_stats_hourly s {join} "
+        f"WHERE s.bucket >= :start AND s.bucket < :end GROUP BY {group} "
+        f"ORDER BY SUM(s.views) DESC"
+    ), {'start': _ts(start), 'end': _ts(end)}).all()
+    return [
+        {dimension: r[0], 'views': r[1] or 0, 'upvotes': r[2] or 0, 'downvotes': r[3] or 0}
+        for r in rows
+    ]
+
+
+def dashboard(days=14):
+    """Everything the admin analytics page shows, for the last `days` days."""
+    end = datetime.utcnow()
+    start = (end - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    series = {}
+    for metric in ('views', 'upvotes', 'downvotes', 'realism_average'):
+        buckets, values = timeseries(metric, start, end, granularity='day')
+        series[metric] = values
+
+    labels = {c.name: c.value for c in PostCategory}
+    by_category = totals_by('category', start, end)
+    for row in by_category:
+        row['category'] = labels.get(row['category'], row['category'])
+
+    return {
+        # Rollups are folded by cron (python analytics.py), not on page load
+        'rolled_up_at': db.session.query(func.max(RollupWatermark.updated_at)).scalar(),
+        'days': list(buckets.astype(object)),
+        'series': series,
+        'realism_histogram': realism_histogram(start=start, end=end),
+        'by_category': by_category,
+        'by_university': totals_by('university', start, end)[:10],
+    }
+
+
+if __name__ == '__main__':
+    # Meant for cron: python analytics.py
+    from app import create_app
+    app = create_app({'WARM_STARTUP': False})
+    with app.app_context():
+        db.create_all()
+        missing = missing_migrations()
+        if missing:
+            raise SystemExit(f"Run {', '.join(missing)} first.")
+        print(run_rollup())
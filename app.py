@@ -1,48 +1,89 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, abort, jsonify
+from flask import Flask, Blueprint, Response, current_app, make_response, render_template, get_template_attribute, redirect, url_for, flash, request, abort, jsonify, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
-from models import db, User, Post, Comment, Vote, PostView, AcademicFeatures, PostCategory, Report
+from jinja2 import FileSystemBytecodeCache
+from models import db, User, Post, Comment, Vote, PostView, AcademicFeatures, PostCategory, Report, PostSignature
 from datetime import datetime, timedelta
+from sqlalchemy import text
 import pytz
 from utils import contains_profanity, clean_text
+import analytics
+from viewstore import store as view_store
+import kvkk_export
+import hashing
+import universities
+from events import broker as event_broker, busy_stream, TooManyStreams
+from related import related_index
+import feeds
+from feeds import feed_store, FEED_FORMATS
+import dedupe
+import comment_window
+from dedupe import dedupe_index
 import os
 from werkzeug.utils import secure_filename
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'yeni-nesil-akademik-forum-key-12345'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///forum.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # 16MB max
+bp = Blueprint('main', __name__)
+
+HASHING_BUSY_MESSAGE = 'Sunucu şu anda çok yoğun. Lütfen birkaç saniye sonra tekrar deneyin.'
+
+def busy_response(template, **context):
+    # Hashing pool is full: answer right away instead of queueing the request
+    flash(HASHING_BUSY_MESSAGE, 'error')
+    response = make_response(render_template(template, **context), 503)
+    response.headers['Retry-After'] = '2'
+    return response
 
-db.init_app(app)
 login_manager = LoginManager()
-login_manager.login_view = 'login'
-login_manager.init_app(app)
+login_manager.login_view = 'main.login'
+
+# Built once at import; with gunicorn --preload every worker shares it
+TR_TZ = pytz.timezone('Europe/Istanbul')
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-@app.before_request
+@bp.before_app_request
 def check_bans():
     if current_user.is_authenticated and current_user.is_banned:
         if current_user.ban_expires_at and current_user.ban_expires_at < datetime.utcnow():
             # Ban has expired
-            current_user.is_banned = False
-            current_user.ban_reason = None
-            current_user.ban_expires_at = None
+            current_user.lift_ban()
             db.session.commit()
+            feed_store.mark_author(current_user.id)
             return
 
-        if request.endpoint not in ['static', 'logout', 'banned_page', 'check_bans']:
-            return redirect(url_for('banned_page'))
+        if request.endpoint not in ['static', 'main.logout', 'main.banned_page', 'main.export_data']:
+            return redirect(url_for('main.banned_page'))
+
+@bp.before_app_request
+def require_kvkk_consent():
+    # Imported accounts (bulk_import.py) have not accepted the KVKK text here
+    if current_user.is_authenticated and current_user.agreed_kvkk is None:
+        if request.endpoint not in ['static', 'main.logout', 'main.kvkk_consent', 'main.export_data']:
+            return redirect(url_for('main.kvkk_consent'))
+
+@bp.route('/kvkk_consent', methods=['GET', 'POST'])
+@login_required
+def kvkk_consent():
+    if current_user.agreed_kvkk is not None:
+        return redirect(url_for('main.index'))
+
+    if request.method == 'POST':
+        if not request.form.get('kvkk_check'):
+            flash('KVKK metnini onaylamanız gerekmektedir.', 'error')
+            return redirect(url_for('main.kvkk_consent'))
+        current_user.agreed_kvkk = datetime.utcnow()
+        db.session.commit()
+        flash('Teşekkürler, hoş geldiniz.', 'success')
+        return redirect(url_for('main.index'))
+    return render_template('kvkk_consent.html', kvkk_text=current_app.config['KVKK_TEXT'])
 
-@app.context_processor
+@bp.app_context_processor
 def inject_now():
     return {'now': datetime.utcnow()}
 
-@app.template_filter('turkish_time')
+@bp.app_template_filter('turkish_time')
 def turkish_time_filter(dt):
     if dt is None:
         return ""
@@ -51,28 +92,39 @@ def turkish_time_filter(dt):
     if dt.tzinfo is None:
         dt = pytz.utc.localize(dt)
     
-    tr_tz = pytz.timezone('Europe/Istanbul')
-    tr_dt = dt.astimezone(tr_tz)
+    tr_dt = dt.astimezone(TR_TZ)
     return tr_dt.strftime('%d.%m.%Y %H:%M')
 
-@app.before_request
+@bp.before_app_request
 def restrict_banned_users():
     if current_user.is_authenticated and current_user.is_banned:
         if request.endpoint and (
             'static' in request.endpoint or 
-            request.endpoint in ['banned_page', 'logout']
+            request.endpoint in ['main.banned_page', 'main.logout', 'main.export_data']
         ):
             return
             
-        return redirect(url_for('banned_page'))
+        return redirect(url_for('main.banned_page'))
 
-@app.route('/')
+@bp.route('/')
 def index():
     page = request.args.get('page', 1, type=int)
     query = request.args.get('q', '').strip()
     category_slug = request.args.get('cat')
+    uni_filter = request.args.get('uni')
     
-    posts_q = Post.query.join(User).filter(User.is_banned == False)
+    # Served by the partial ix_post_visible_* indexes, no join
+    posts_q = Post.query.filter(Post.author_visible == True)
+
+    # "Posts from my university": ix_user_university_id -> ix_post_author_id
+    university_id = None
+    if uni_filter == 'mine':
+        if current_user.is_authenticated:
+            university_id = current_user.university_id
+    elif uni_filter and uni_filter.isdigit():
+        university_id = int(uni_filter)
+    if university_id:
+        posts_q = posts_q.join(User).filter(User.university_id == university_id)
     
     if query:
         posts_q = posts_q.filter(
@@ -92,12 +144,12 @@ def index():
 
     posts = posts_q.order_by(Post.created_at.desc()).paginate(page=page, per_page=10)
         
-    return render_template('index.html', posts=posts, query=query, current_cat=category_slug)
+    return render_template('index.html', posts=posts, query=query, current_cat=category_slug, current_uni=uni_filter)
 
-@app.route('/banned', methods=['GET', 'POST'])
+@bp.route('/banned', methods=['GET', 'POST'])
 def banned_page():
     if not current_user.is_authenticated or not current_user.is_banned:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
         
     if request.method == 'POST':
         appeal = request.form.get('appeal')
@@ -108,14 +160,10 @@ def banned_page():
             
     return render_template('banned.html', user=current_user)
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
-    # Read KVKK text
-    try:
-        with open('kvkk.txt', 'r', encoding='utf-8') as f:
-            kvkk_text = f.read()
-    except:
-        kvkk_text = "KVKK Aydınlatma Metni bulunamadı."
+    # KVKK text is read once at startup (see warm_up)
+    kvkk_text = current_app.config['KVKK_TEXT']
 
     if request.method == 'POST':
         username = request.form.get('username')
@@ -126,92 +174,110 @@ def register():
 
         if not agreed:
             flash('KVKK metnini onaylamanız gerekmektedir.', 'error')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         if contains_profanity(username) or contains_profanity(university) or contains_profanity(bio):
             flash('Kullanıcı adı, üniversite veya biyografide yasaklı kelimeler tespit edildi.', 'error')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         if User.query.filter_by(username=username).first():
             flash('Bu kullanıcı adı zaten alınmış.', 'error')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         new_user = User(username=username, university=university, bio=bio, agreed_kvkk=datetime.utcnow())
-        new_user.set_password(password)
+        uni = universities.resolve(university)
+        new_user.university_id = uni.id if uni else None
+        try:
+            new_user.set_password(password)
+        except hashing.HashingBusy:
+            return busy_response('register.html', kvkk_text=kvkk_text)
         db.session.add(new_user)
         db.session.commit()
         
         login_user(new_user)
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     return render_template('register.html', kvkk_text=kvkk_text)
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
         user = User.query.filter_by(username=username).first()
 
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and user.check_password(password)
+        except hashing.HashingBusy:
+            return busy_response('login.html')
+
+        if valid:
+            # Bring hashes made with older parameters up to date; not worth
+            # failing the login over if the pool is busy.
+            if hashing.needs_rehash(user.password_hash):
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except hashing.HashingBusy:
+                    pass
+
             # Check if user is banned
             if user.is_banned:
                 # Check if ban has expired
                 if user.ban_expires_at and user.ban_expires_at < datetime.utcnow():
-                    user.is_banned = False
-                    user.ban_reason = None
-                    user.ban_expires_at = None
+                    user.lift_ban()
                     db.session.commit()
+                    feed_store.mark_author(user.id)
                     flash('Ban süreniz doldu, tekrar hoş geldiniz.', 'success')
                 else:
                     # User is still banned. 
                     # We MUST log them in so they can access the /banned page and appeal.
                     login_user(user)
-                    return redirect(url_for('banned_page'))
+                    return redirect(url_for('main.banned_page'))
 
             login_user(user)
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Giriş başarısız. Kullanıcı adı veya şifre yanlış.', 'error')
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/profile')
+@bp.route('/profile')
 @login_required
 def profile():
-    return redirect(url_for('view_profile', username=current_user.username))
+    return redirect(url_for('main.view_profile', username=current_user.username))
 
-@app.route('/u/<username>')
+@bp.route('/u/<username>')
 def view_profile(username):
     user = User.query.filter_by(username=username).first_or_404()
     return render_template('profile.html', user=user)
 
-@app.route('/report/<int:user_id>', methods=['POST'])
+@bp.route('/report/<int:user_id>', methods=['POST'])
 @login_required
 def report_user(user_id):
     if user_id == current_user.id:
         flash('Kendinizi şikayet edemezsiniz.', 'error')
-        return redirect(url_for('view_profile', username=current_user.username))
+        return redirect(url_for('main.view_profile', username=current_user.username))
         
     user_to_report = User.query.get_or_404(user_id)
     reason = request.form.get('reason')
     
     if not reason:
         flash('Lütfen bir sebep belirtin.', 'error')
-        return redirect(url_for('view_profile', username=user_to_report.username))
+        return redirect(url_for('main.view_profile', username=user_to_report.username))
         
     new_report = Report(reporter_id=current_user.id, reported_user_id=user_id, reason=reason)
     db.session.add(new_report)
     db.session.commit()
     
     flash('Kullanıcı şikayet edildi. Yönetim inceleyecektir.', 'success')
-    return redirect(url_for('view_profile', username=user_to_report.username))
+    return redirect(url_for('main.view_profile', username=user_to_report.username))
 
-@app.route('/delete_post/<int:post_id>', methods=['POST'])
+@bp.route('/delete_post/<int:post_id>', methods=['POST'])
 @login_required
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
@@ -220,12 +286,16 @@ def delete_post(post_id):
     if post.author_id != current_user.id and not current_user.is_admin:
         abort(403)
         
+    category = post.category
     db.session.delete(post)
     db.session.commit()
+    related_index.remove_post(post_id)
+    dedupe_index.remove(post_id)
+    feed_store.mark_post(post_id, category)
     flash('Gönderi başarıyla silindi.', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/delete_comment/<int:comment_id>', methods=['POST'])
+@bp.route('/delete_comment/<int:comment_id>', methods=['POST'])
 @login_required
 def delete_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
@@ -235,21 +305,28 @@ def delete_comment(comment_id):
     if comment.author_id != current_user.id and not current_user.is_admin:
         abort(403)
         
+    parent_id = comment.parent_id
     db.session.delete(comment)
     db.session.commit()
+    event_broker.publish(post_id, 'comment_deleted', {'id': comment_id, 'parent_id': parent_id})
     flash('Yorum başarıyla silindi.', 'success')
-    return redirect(url_for('view_post', post_id=post_id))
+    return redirect(url_for('main.view_post', post_id=post_id))
 
-@app.route('/admin/reports')
+@bp.route('/admin/reports')
 @login_required
 def admin_reports():
     if not current_user.is_admin:
         abort(403)
     reports = Report.query.filter_by(is_resolved=False).order_by(Report.created_at.desc()).all()
     banned_users = User.query.filter_by(is_banned=True).all()
-    return render_template('admin_reports.html', reports=reports, banned_users=banned_users)
-
-@app.route('/admin/resolve_report/<int:report_id>')
+    # Posts flagged as near-duplicates at submission (see dedupe.py)
+    flagged = PostSignature.query.filter(PostSignature.duplicate_of_id.isnot(None)) \
+        .order_by(PostSignature.created_at.desc()).limit(50).all()
+    duplicates = [(db.session.get(Post, s.post_id), db.session.get(Post, s.duplicate_of_id), s.similarity)
+                  for s in flagged]
+    return render_template('admin_reports.html', reports=reports, banned_users=banned_users, duplicates=duplicates)
+
+@bp.route('/admin/resolve_report/<int:report_id>')
 @login_required
 def resolve_report(report_id):
     if not current_user.is_admin:
@@ -258,15 +335,82 @@ def resolve_report(report_id):
     report.is_resolved = True
     db.session.commit()
     flash('Şikayet çözüldü olarak işaretlendi.', 'success')
-    return redirect(url_for('admin_reports'))
+    return redirect(url_for('main.admin_reports'))
 
-@app.route('/update_profile', methods=['POST'])
+@bp.route('/admin/dismiss_duplicate/<int:post_id>')
+@login_required
+def dismiss_duplicate(post_id):
+    if not current_user.is_admin:
+        abort(403)
+    sig = PostSignature.query.filter_by(post_id=post_id).first_or_404()
+    sig.duplicate_of_id = None
+    sig.similarity = None
+    db.session.commit()
+    flash('Gönderi tekrar listesinden çıkarıldı.', 'success')
+    return redirect(url_for('main.admin_reports'))
+
+@bp.route('/admin/analytics')
+@login_required
+def admin_analytics():
+    if not current_user.is_admin:
+        abort(403)
+    # Reads the rollups only; they are folded by cron (python analytics.py)
+    days = request.args.get('days', 14, type=int)
+    stats = analytics.dashboard(days=max(1, min(days, 90)))
+    return render_template('admin_analytics.html', stats=stats, days=days)
+
+@bp.route('/api/universities')
+def api_universities():
+    q = request.args.get('q', '')[:100]
+    results = [{'id': uni_id, 'name': name} for uni_id, name in universities.directory.search(q)]
+    response = jsonify(results)
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+# Feeds and sitemaps are served from precompressed files (feeds.py)
+@bp.route('/feed.<fmt>')
+def feed(fmt):
+    if fmt not in FEED_FORMATS:
+        abort(404)
+    return feed_store.serve(f"{fmt}-all", f"application/{fmt}+xml")
+
+@bp.route('/feed/<category>.<fmt>')
+def category_feed(category, fmt):
+    try:
+        PostCategory(category)
+    except ValueError:
+        abort(404)
+    if fmt not in FEED_FORMATS:
+        abort(404)
+    return feed_store.serve(f"{fmt}-{category}", f"application/{fmt}+xml")
+
+@bp.route('/sitemap.xml')
+def sitemap():
+    return feed_store.serve('sitemap', 'application/xml')
+
+@bp.route('/sitemap-<int:partition>.xml')
+def sitemap_partition(partition):
+    max_id = db.session.query(db.func.max(Post.id)).scalar() or 0
+    if partition > max_id // feeds.SITEMAP_PARTITION:
+        abort(404)
+    return feed_store.serve(f"sitemap-{partition}", 'application/xml')
+
+@bp.route('/update_profile', methods=['POST'])
 @login_required
 def update_profile():
     new_username = request.form.get('username')
     university = request.form.get('university')
     bio = request.form.get('bio')
     password = request.form.get('password')
+
+    # Hash first so a busy pool rejects the update before anything is saved
+    new_password_hash = None
+    if password:
+        try:
+            new_password_hash = hashing.hash_password(password)
+        except hashing.HashingBusy:
+            flash(HASHING_BUSY_MESSAGE, 'error')
+            return redirect(url_for('main.profile'))
     
     # Image Upload
     if 'profile_image' in request.files:
@@ -275,12 +419,12 @@ def update_profile():
             filename = secure_filename(file.filename)
             # Make unique to prevent overwrite/caching issues
             unique_filename = f"{current_user.id}_{int(datetime.utcnow().timestamp())}_{filename}"
-            file.save(os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], unique_filename))
+            file.save(os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'], unique_filename))
             current_user.profile_image = unique_filename
 
     if contains_profanity(university) or contains_profanity(bio) or (new_username and contains_profanity(new_username)):
         flash('Yasaklı kelime tespit edildi. Profil güncellenemedi.', 'error')
-        return redirect(url_for('profile'))
+        return redirect(url_for('main.profile'))
 
     # Handle Username Change
     if new_username and new_username != current_user.username:
@@ -296,19 +440,22 @@ def update_profile():
                 current_user.last_username_change = datetime.utcnow()
                 flash('Kullanıcı adı başarıyla değiştirildi.', 'success')
 
+    if university != current_user.university or current_user.university_id is None:
+        uni = universities.resolve(university)
+        current_user.university_id = uni.id if uni else None
     current_user.university = university
     current_user.bio = bio
     
-    if password:
-        current_user.set_password(password)
+    if new_password_hash:
+        current_user.password_hash = new_password_hash
 
     db.session.commit()
     flash('Profil bilgileri güncellendi.', 'success')
-    return redirect(url_for('profile'))
+    return redirect(url_for('main.profile'))
 
 
 
-@app.route('/create', methods=['GET', 'POST'])
+@bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create_post():
     if request.method == 'POST':
@@ -318,38 +465,40 @@ def create_post():
         
         if contains_profanity(title) or contains_profanity(content):
              flash('İçerikte yasaklı kelimeler bulundu!', 'error')
-             return redirect(url_for('create_post'))
+             return redirect(url_for('main.create_post'))
 
         try:
             category = PostCategory(category_str)
         except ValueError:
             flash('Geçersiz kategori seçimi.', 'error')
-            return redirect(url_for('create_post'))
+            return redirect(url_for('main.create_post'))
+
+        # Near-duplicates: refused above REJECT_THRESHOLD, flagged for admins above FLAG_THRESHOLD
+        sig = dedupe.signature(title, content)
+        matches = dedupe_index.check(sig)
+        if matches and matches[0][1] >= dedupe.REJECT_THRESHOLD:
+            original = db.session.get(Post, matches[0][0])
+            flash(f'Bu konu zaten açılmış: "{original.title}". Lütfen mevcut tartışmaya katılın.', 'error')
+            return redirect(url_for('main.view_post', post_id=original.id))
 
         new_post = Post(title=title, content=content, category=category, author=current_user)
         db.session.add(new_post)
+        db.session.flush()
+        dedupe_index.record(new_post, sig, matches[0] if matches else None)
         db.session.commit()
-        return redirect(url_for('index'))
+        related_index.add_post(new_post)
+        feed_store.mark_post(new_post.id, new_post.category)
+        return redirect(url_for('main.index'))
     return render_template('create_post.html')
 
-@app.route('/post/<int:post_id>', methods=['GET'])
+@bp.route('/post/<int:post_id>', methods=['GET'])
 def view_post(post_id):
     post = Post.query.get_or_404(post_id)
     
     # Handle view counting (Unique per user)
-    viewer_id = current_user.id if current_user.is_authenticated else None
-    
-    # If authenticated, check if they viewed before
-    should_count = False
+    # Repeat views are answered from the in-memory viewer bitmap
     if current_user.is_authenticated:
-        view = PostView.query.filter_by(post_id=post.id, user_id=current_user.id).first()
-        if not view:
-            should_count = True
-            db.session.add(PostView(post_id=post.id, user_id=current_user.id))
-    
-    if should_count:
-        post.view_count += 1
-        db.session.commit()
+        view_store.record_view(post, current_user.id)
 
     # Calculate user's current votes on academic features if logged in
     user_votes = {}
@@ -363,17 +512,116 @@ def view_post(post_id):
         if main_vote:
             user_votes['main_vote'] = main_vote.value
 
-    # Filter comments from banned users
-    # We only want top-level comments here. Replies will be accessed via comment.replies
-    all_comments = [c for c in post.comments if not c.author.is_banned]
-    top_level_comments = [c for c in all_comments if c.parent_id is None]
-    
-    # Sort by date desc
-    top_level_comments.sort(key=lambda x: x.created_at, reverse=True)
+    # First window of the thread only; the rest is loaded on demand
+    # (post_comments / comment_replies). Banned authors are left out.
+    top_level_comments, next_cursor = comment_window.top_level(post.id)
+    thread = comment_window.load_thread(post.id, top_level_comments)
+
+    # Served from the in-memory TF-IDF index, one IN query for the rows and
+    # one grouped count for their comments
+    related_ids = related_index.related(post.id)
+    related_posts = []
+    related_comment_counts = {}
+    if related_ids:
+        found = {p.id: p for p in Post.query.filter(Post.id.in_(related_ids), Post.author_visible == True)}
+        related_posts = [found[i] for i in related_ids if i in found]
+        related_comment_counts = dict(
+            db.session.query(Comment.post_id, db.func.count(Comment.id))
+            .filter(Comment.post_id.in_(found), Comment.author_visible == True)
+            .group_by(Comment.post_id)
+            .all()
+        )
 
-    return render_template('post_detail.html', post=post, user_votes=user_votes, comments=top_level_comments)
+    return render_template('post_detail.html', post=post, user_votes=user_votes, comments=top_level_comments,
+                           thread=thread, next_cursor=next_cursor,
+                           comment_count=comment_window.top_level_count(post.id),
+                           related_posts=related_posts, related_comment_counts=related_comment_counts)
+
+def comment_page(post_id, comments, next_cursor, depth):
+    """JSON for one window of comments: rendered cards, or plain fields with format=json."""
+    thread = comment_window.load_thread(post_id, comments, depth=1)
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'comments': [{
+                'id': c.id,
+                'parent_id': c.parent_id,
+                'author': c.author.username,
+                'content': c.content,
+                'created_at': c.created_at.isoformat(),
+                'has_replies': c.id in thread,
+            } for c in comments],
+            'next_cursor': next_cursor,
+        })
+    html = render_template('_comment_page.html', comments=comments, thread=thread, depth=depth)
+    return jsonify({'html': html, 'next_cursor': next_cursor})
+
+@bp.route('/post/<int:post_id>/comments')
+def post_comments(post_id):
+    post = Post.query.get_or_404(post_id)
+    try:
+        comments, next_cursor = comment_window.top_level(post.id, request.args.get('cursor'))
+    except comment_window.InvalidCursor:
+        abort(400)
+    return comment_page(post.id, comments, next_cursor, depth=0)
 
-@app.route('/add_comment/<int:post_id>', methods=['POST'])
+@bp.route('/post/<int:post_id>/comments/<int:parent_id>/replies')
+def comment_replies(post_id, parent_id):
+    post = Post.query.get_or_404(post_id)
+    # The parent must be a comment on this post, not just any comment id
+    Comment.query.filter_by(id=parent_id, post_id=post.id).first_or_404()
+    try:
+        comments, next_cursor = comment_window.replies(post.id, parent_id, request.args.get('cursor'))
+    except comment_window.InvalidCursor:
+        abort(400)
+    depth = max(1, min(request.args.get('depth', 1, type=int), 10))
+    return comment_page(post.id, comments, next_cursor, depth)
+
+def live_counts(post_id):
+    """Absolute counters shown on post_detail, for (re)connecting streams."""
+    likes, dislikes = db.session.execute(text(
+        "SELECT COALESCE(SUM(value = 1), 0), COALESCE(SUM(value = -1), 0) FROM vote WHERE post_id = :pid"
+    ), {'pid': post_id}).one()
+    academic = {row[0]: (row[1], row[2]) for row in db.session.execute(text(
+        "SELECT type, COUNT(*), AVG(value) FROM academic_features WHERE post_id = :pid GROUP BY type"
+    ), {'pid': post_id})}
+    comments = db.session.execute(text(
+        "SELECT COUNT(*) FROM comment "
+        "WHERE post_id = :pid AND parent_id IS NULL AND author_visible = 1"
+    ), {'pid': post_id}).scalar()
+    realism = academic.get('realism_score', (0, None))[1]
+    return {
+        'likes': likes,
+        'dislikes': dislikes,
+        'experience': academic.get('is_experience', (0, None))[0],
+        'wish_knew': academic.get('is_wish_knew', (0, None))[0],
+        'realism_average': round(realism, 1) if realism else 0,
+        'comments': comments,
+    }
+
+@bp.route('/post/<int:post_id>/events')
+def post_events(post_id):
+    post = Post.query.get_or_404(post_id)
+    # Reconnects may have missed events: start them from absolute values
+    snapshot = live_counts(post.id) if request.headers.get('Last-Event-ID') else None
+    # The stream can stay open for minutes; don't pin a pooled connection
+    db.session.remove()
+    try:
+        sub = event_broker.subscribe(post_id)
+    except TooManyStreams:
+        # Page still works without live updates; the client retries later
+        sub = None
+    if sub is None:
+        response = Response(busy_stream(), mimetype='text/event-stream')
+    else:
+        response = Response(stream_with_context(event_broker.stream(sub, snapshot)), mimetype='text/event-stream')
+        # The generator's finally only runs if the body is iterated: HEAD
+        # requests and clients gone before the first chunk never get there
+        response.call_on_close(sub.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@bp.route('/add_comment/<int:post_id>', methods=['POST'])
 @login_required
 def add_comment(post_id):
     post = Post.query.get_or_404(post_id)
@@ -382,11 +630,11 @@ def add_comment(post_id):
     
     if not content or not content.strip():
         flash('Yorum içeriği boş olamaz.', 'error')
-        return redirect(url_for('view_post', post_id=post_id))
+        return redirect(url_for('main.view_post', post_id=post_id))
     
     if contains_profanity(content):
         flash('Yorumunuz uygunsuz ifadeler içeriyor.', 'error')
-        return redirect(url_for('view_post', post_id=post_id))
+        return redirect(url_for('main.view_post', post_id=post_id))
     
     # Check parent if reply
     parent = None
@@ -410,22 +658,31 @@ def add_comment(post_id):
     
     db.session.add(new_comment)
     db.session.commit()
+
+    render_comment = get_template_attribute('_comment.html', 'render_comment')
+    event_broker.publish(post_id, 'comment', {
+        'id': new_comment.id,
+        'parent_id': new_comment.parent_id,
+        'html': str(render_comment(new_comment, 1 if parent else 0, True)),
+    })
     
     flash('Yorumunuz eklendi.', 'success')
-    return redirect(url_for('view_post', post_id=post_id))
+    return redirect(url_for('main.view_post', post_id=post_id))
 
 
-@app.route('/vote/<int:post_id>/<string:action>')
+@bp.route('/vote/<int:post_id>/<string:action>')
 @login_required
 def vote_post(post_id, action):
     post = Post.query.get_or_404(post_id)
     existing_vote = Vote.query.filter_by(user_id=current_user.id, post_id=post.id).first()
     
     val = 1 if action == 'up' else -1
+    old = existing_vote.value if existing_vote else 0
     
     if existing_vote:
         if existing_vote.value == val:
             db.session.delete(existing_vote) # Toggle off
+            val = 0
         else:
             existing_vote.value = val # Change vote
     else:
@@ -433,9 +690,13 @@ def vote_post(post_id, action):
         db.session.add(new_vote)
     
     db.session.commit()
-    return redirect(url_for('view_post', post_id=post.id))
+    event_broker.publish(post.id, 'votes', {
+        'likes': (val == 1) - (old == 1),
+        'dislikes': (val == -1) - (old == -1),
+    })
+    return redirect(url_for('main.view_post', post_id=post.id))
 
-@app.route('/vote_academic/<int:post_id>/<string:vtype>', methods=['POST'])
+@bp.route('/vote_academic/<int:post_id>/<string:vtype>', methods=['POST'])
 @login_required
 def vote_academic(post_id, vtype):
     if vtype not in ['realism_score', 'is_experience', 'is_wish_knew']:
@@ -449,9 +710,11 @@ def vote_academic(post_id, vtype):
         type=vtype
     ).first()
 
+    delta = 1
     if existing:
         if vtype in ['is_experience', 'is_wish_knew']:
             db.session.delete(existing)
+            delta = -1
         else:
             existing.value = value
     else:
@@ -459,20 +722,25 @@ def vote_academic(post_id, vtype):
         db.session.add(new_feat)
     
     db.session.commit()
-    return redirect(url_for('view_post', post_id=post_id))
+    if vtype == 'realism_score':
+        live = {'realism_average': live_counts(post_id)['realism_average']}
+    else:
+        live = {'experience' if vtype == 'is_experience' else 'wish_knew': delta}
+    event_broker.publish(post_id, 'academic', live)
+    return redirect(url_for('main.view_post', post_id=post_id))
 
-@app.route('/report_post/<int:post_id>', methods=['POST'])
+@bp.route('/report_post/<int:post_id>', methods=['POST'])
 @login_required
 def report_post(post_id):
     post = Post.query.get_or_404(post_id)
     if post.author_id == current_user.id:
         flash('Kendi gönderinizi şikayet edemezsiniz.', 'error')
-        return redirect(url_for('view_post', post_id=post_id))
+        return redirect(url_for('main.view_post', post_id=post_id))
         
     reason = request.form.get('reason')
     if not reason:
         flash('Lütfen sebep belirtin.', 'error')
-        return redirect(url_for('view_post', post_id=post_id))
+        return redirect(url_for('main.view_post', post_id=post_id))
         
     new_report = Report(
         reporter_id=current_user.id, 
@@ -484,9 +752,9 @@ def report_post(post_id):
     db.session.commit()
     
     flash('Gönderi şikayet edildi.', 'success')
-    return redirect(url_for('view_post', post_id=post_id))
+    return redirect(url_for('main.view_post', post_id=post_id))
 
-@app.route('/ban/<int:user_id>', methods=['POST'])
+@bp.route('/ban/<int:user_id>', methods=['POST'])
 @login_required
 def ban_user(user_id):
     if not current_user.is_admin:
@@ -496,39 +764,38 @@ def ban_user(user_id):
     reason = request.form.get('reason', 'Kural ihlali')
     duration = request.form.get('duration') # e.g., "1_day", "7_days", "permanent"
     
-    user_to_ban.is_banned = True
-    user_to_ban.ban_reason = reason
-    
     if duration == '1_day':
-        user_to_ban.ban_expires_at = datetime.utcnow() + timedelta(days=1)
+        expires_at = datetime.utcnow() + timedelta(days=1)
     elif duration == '7_days':
-        user_to_ban.ban_expires_at = datetime.utcnow() + timedelta(days=7)
+        expires_at = datetime.utcnow() + timedelta(days=7)
     elif duration == '30_days':
-        user_to_ban.ban_expires_at = datetime.utcnow() + timedelta(days=30)
+        expires_at = datetime.utcnow() + timedelta(days=30)
     else:
-        user_to_ban.ban_expires_at = None # Permanent
-        
+        expires_at = None # Permanent
+
+    # Also hides their posts and comments (author_visible)
+    user_to_ban.ban(reason, expires_at)
     db.session.commit()
+    feed_store.mark_author(user_to_ban.id)
     flash(f'Kullanıcı banlandı: {user_to_ban.username}', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/unban/<int:user_id>', methods=['POST'])
+@bp.route('/unban/<int:user_id>', methods=['POST'])
 @login_required
 def unban_user(user_id):
     if not current_user.is_admin:
         abort(403)
         
     user_to_unban = User.query.get_or_404(user_id)
-    user_to_unban.is_banned = False
-    user_to_unban.ban_reason = None
-    user_to_unban.ban_expires_at = None
+    user_to_unban.lift_ban()
     user_to_unban.ban_appeal_reason = None
     db.session.commit()
+    feed_store.mark_author(user_to_unban.id)
     
     flash(f'{user_to_unban.username} yasağı kaldırıldı.', 'success')
-    return redirect(request.referrer or url_for('admin_reports'))
+    return redirect(request.referrer or url_for('main.admin_reports'))
 
-@app.route('/reject_appeal/<int:user_id>', methods=['POST'])
+@bp.route('/reject_appeal/<int:user_id>', methods=['POST'])
 @login_required
 def reject_appeal(user_id):
     if not current_user.is_admin:
@@ -542,14 +809,41 @@ def reject_appeal(user_id):
     db.session.commit()
     
     flash(f'{user_to_reject.username} kullanıcısının itirazı reddedildi.', 'info')
-    return redirect(request.referrer or url_for('admin_reports'))
+    return redirect(request.referrer or url_for('main.admin_reports'))
+
+@bp.route('/export_data')
+@login_required
+def export_data():
+    # KVKK data-subject request; also open to banned users
+    fmt = request.args.get('format', 'ndjson')
+    stamp = datetime.utcnow().strftime('%Y%m%d')
+    if fmt == 'zip':
+        upload_dir = os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
+        body = kvkk_export.iter_zip(current_user.id, upload_dir, current_user.created_at)
+        mimetype, filename = 'application/zip', f"kvkk_{current_user.username}_{stamp}.zip"
+    else:
+        body = kvkk_export.iter_ndjson(current_user.id)
+        mimetype, filename = 'application/x-ndjson', f"kvkk_{current_user.username}_{stamp}.ndjson"
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="{secure_filename(filename)}"',
+            'Cache-Control': 'no-store',
+        }
+    )
 
-@app.route('/delete_account', methods=['POST'])
+@bp.route('/delete_account', methods=['POST'])
 @login_required
 def delete_account():
     try:
         user = User.query.get(current_user.id)
         if user:
+            # Viewer bitmaps are not covered by the cascades below
+            view_store.forget_user(user.id)
+            posts = [(p.id, p.category) for p in user.posts]
+
             # Delete user - SQLAlchemy cascades defined in models.py will handle:
             # - User's posts (and their comments/votes)
             # - User's comments
@@ -559,22 +853,100 @@ def delete_account():
             # - Reports related to user
             db.session.delete(user)
             db.session.commit()
+            for post_id, category in posts:
+                related_index.remove_post(post_id)
+                dedupe_index.remove(post_id)
+                feed_store.mark_post(post_id, category)
             
             logout_user()
             flash('Hesabınız ve tüm verileriniz başarıyla silindi. Sizi özleyeceğiz...', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Hesap bulunamadı.', 'error')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
     except Exception as e:
         db.session.rollback()
         # Log error in production
         print(f"Delete Account Error: {e}")
         flash('Hesap silinirken bir hata oluştu. Lütfen daha sonra tekrar deneyin.', 'error')
-        return redirect(url_for('profile'))
+        return redirect(url_for('main.profile'))
 
 
+def load_kvkk_text(app):
+    try:
+        with open(os.path.join(app.root_path, 'kvkk.txt'), 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return "KVKK Aydınlatma Metni bulunamadı."
+
+def warm_up(app):
+    """
+    Startup phase: everything a first request would otherwise pay for.
+    Runs in the gunicorn master under --preload, so forked workers inherit
+    it copy-on-write.
+    """
+    app.config['KVKK_TEXT'] = load_kvkk_text(app)
+
+    # Compile every template once; bytecode is also cached on disk so the
+    # next process start skips parsing.
+    cache_dir = os.path.join(app.instance_path, 'jinja_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+    with app.app_context():
+        related_index.ensure_built()
+        dedupe_index.refresh()
+        universities.directory.build()
+        feed_store.catch_up()
+
+# related_index, event_broker, feed_store and the dedupe, university and
+# view caches are module-level singletons: one app per process.
+_app = None
+
+def create_app(config=None):
+    """
+    Builds the app. The served one lives in wsgi.py; scripts build their own
+    and pass WARM_STARTUP=False so they run against a not yet migrated
+    database and skip loading the indexes.
+    """
+    global _app
+    if _app is not None:
+        raise RuntimeError("create_app() already ran in this process; its singletons are bound to that app")
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'yeni-nesil-akademik-forum-key-12345'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///forum.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['UPLOAD_FOLDER'] = 'static/uploads'
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # 16MB max
+    app.config['WARM_STARTUP'] = os.environ.get('WARM_STARTUP', '1') != '0'
+    # Absolute links in feeds and sitemaps (e.g. https://akademi.example);
+    # they are not served without it
+    app.config['SITE_URL'] = os.environ.get('SITE_URL')
+    if config:
+        app.config.update(config)
+
+    os.makedirs(app.instance_path, exist_ok=True)
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    related_index.init_app(app)
+    event_broker.init_app(app)
+    feed_store.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+
+    if app.config['WARM_STARTUP']:
+        warm_up(app)
+    else:
+        app.config['KVKK_TEXT'] = load_kvkk_text(app)
+    _app = app
+    return app
+
 if __name__ == '__main__':
+    app = create_app({'SITE_URL': os.environ.get('SITE_URL', 'http://127.0.0.1:5000')})
     with app.app_context():
         # THIS WILL WIPE DATA TO FIX SCHEMA ERROR - DISABLED FOR PERSISTENCE
         # db.drop_all() 
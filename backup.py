@@ -0,0 +1,177 @@
+"""
+Online backups of the SQLite database.
+
+    python backup.py                      # backups/forum-<timestamp>.db next to the database
+    python backup.py /mnt/backups/x.db    # explicit destination
+    python backup.py --keep 7             # also prune all but the newest 7
+
+The database is the one the app is configured with (SQLALCHEMY_DATABASE_URI).
+
+Uses the SQLite backup API, PAGES_PER_STEP pages at a time with a pause
+between steps: the source is only read-locked for the duration of one
+step, so the app keeps writing while the copy runs. A write from another
+connection in between makes SQLite restart the copy from the first page,
+so a database written to more often than a full pass takes may never
+finish. After MAX_RESTARTS restarts the copy is done in one step
+instead, holding the read lock for the whole copy.
+
+The copy is written to <dest>.part and only renamed into place after
+PRAGMA integrity_check passes and its row counts match the source.
+"""
+import os
+import sys
+import time
+import sqlite3
+from datetime import datetime
+
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.02
+MAX_RESTARTS = 5
+
+
+class BackupError(Exception):
+    pass
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def database_path():
+    """File behind the app's SQLALCHEMY_DATABASE_URI."""
+    from app import create_app
+    from models import db
+
+    app = create_app({'WARM_STARTUP': False})
+    with app.app_context():
+        return db.engine.url.database
+
+
+def backup_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'backups')
+
+
+def _tables(conn):
+    return [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+
+
+def row_counts(conn):
+    return {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in _tables(conn)}
+
+
+def verify(src, path, version):
+    """
+    Raises BackupError unless the copy at `path` is sound and matches
+    `src`. version is src's PRAGMA data_version as of the copied snapshot.
+    """
+    dst = sqlite3.connect(path)
+    try:
+        result = dst.execute("PRAGMA integrity_check").fetchall()
+        if result != [('ok',)]:
+            raise BackupError(f"integrity_check: {result[:5]}")
+        copied = row_counts(dst)
+    finally:
+        dst.close()
+
+    # data_version changes when another connection commits: counts that
+    # differ only because the app wrote after the snapshot are not an error.
+    source = row_counts(src)
+    changed = src.execute("PRAGMA data_version").fetchone()[0] != version
+    diff = {t: (source.get(t), copied.get(t)) for t in source.keys() | copied.keys()
+            if source.get(t) != copied.get(t)}
+    if diff and not changed:
+        raise BackupError(f"row counts differ: {diff}")
+    return copied, diff
+
+
+def backup(db_path, dest=None, pages=PAGES_PER_STEP, sleep=STEP_SLEEP, max_restarts=MAX_RESTARTS, quiet=False):
+    """Snapshots db_path to dest (default: backup_dir(db_path)/forum-<timestamp>.db). Returns dest."""
+    if dest is None:
+        os.makedirs(backup_dir(db_path), exist_ok=True)
+        dest = os.path.join(backup_dir(db_path), f"forum-{datetime.now():%Y%m%d-%H%M%S}.db")
+    part = dest + '.part'
+    if os.path.exists(part):
+        os.remove(part)
+
+    restarts = 0
+    done = 0
+    version = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, done, version
+        if remaining:
+            # A write before the next step would restart the copy, so when
+            # the last step runs the source is still at this version
+            version = src.execute("PRAGMA data_version").fetchone()[0]
+        if total - remaining < done:
+            # A write from another connection: SQLite starts over at page 1
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        done = total - remaining
+        if not quiet:
+            print(f"\r  {done}/{total} pages", end='', flush=True)
+        # The source lock is dropped between steps; sqlite3 itself only
+        # sleeps when a step comes back BUSY.
+        if remaining:
+            time.sleep(sleep)
+
+    started = time.monotonic()
+    src = sqlite3.connect(db_path, timeout=30)
+    try:
+        dst = sqlite3.connect(part)
+        try:
+            try:
+                version = src.execute("PRAGMA data_version").fetchone()[0]
+                src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+            except _TooManyRestarts:
+                if not quiet:
+                    print(f"\n  restarted {restarts} times, copying in one step")
+                version = src.execute("PRAGMA data_version").fetchone()[0]
+                src.backup(dst, pages=-1)
+        finally:
+            dst.close()
+        if not quiet:
+            print()
+        counts, diff = verify(src, part, version)
+    except Exception:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    finally:
+        src.close()
+    os.replace(part, dest)
+
+    if not quiet:
+        size = os.path.getsize(dest)
+        print(f"{dest}: {size} bytes, {sum(counts.values())} rows in {len(counts)} tables, "
+              f"{time.monotonic() - started:.2f}s" + (f", {restarts} restarts" if restarts else ''))
+        for table, (source, copied) in sorted(diff.items()):
+            print(f"  {table}: {copied} rows in the snapshot, {source} now (written since)")
+    return dest
+
+
+def prune(keep, directory):
+    """Deletes all but the newest `keep` forum-*.db backups."""
+    backups = sorted(f for f in os.listdir(directory) if f.startswith('forum-') and f.endswith('.db'))
+    for name in backups[:-keep] if keep else backups:
+        os.remove(os.path.join(directory, name))
+        print(f"removed {name}")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    keep = None
+    if '--keep' in args:
+        i = args.index('--keep')
+        keep = int(args[i + 1])
+        del args[i:i + 2]
+    db_path = database_path()
+    try:
+        backup(db_path, dest=args[0] if args else None)
+    except BackupError as e:
+        print(f"Backup failed: {e}")
+        sys.exit(1)
+    if keep is not None and not args:
+        prune(keep, backup_dir(db_path))
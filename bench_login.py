@@ -0,0 +1,149 @@
+"""
+Feed latency during a login storm, with password hashing inline vs on the
+hashing pool (hashing.py).
+
+    python bench_login.py [seconds] [login_clients]
+
+Each mode starts gunicorn (gunicorn.conf.py) on a throwaway database, then
+measures GET / from one client while `login_clients` threads post to
+/login nonstop.
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+import statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+USERS = 50
+PASSWORD = 'bench-password'
+
+SEED = r'''
+import sys
+from datetime import datetime
+from werkzeug.security import generate_password_hash
+from app import create_app, db
+from models import User, Post, PostCategory
+import hashing
+app = create_app({'WARM_STARTUP': False})
+pwhash = generate_password_hash(sys.argv[1], hashing.PASSWORD_METHOD)
+with app.app_context():
+    for i in range(int(sys.argv[2])):
+        user = User(username=f'bench{i}', agreed_kvkk=datetime.utcnow(), password_hash=pwhash)
+        db.session.add(user)
+        for j in range(4):
+            db.session.add(Post(title=f'Konu {i}-{j}', content='Bench içerik ' * 20,
+                                category=PostCategory.GENERAL, author=user))
+    db.session.commit()
+'''
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_up(base, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base + '/', timeout=2).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not come up')
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _feed_latencies(base, stop):
+    samples = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        urllib.request.urlopen(base + '/', timeout=30).read()
+        samples.append(time.perf_counter() - start)
+        time.sleep(0.02)
+    return samples
+
+
+def _login_storm(base, index, stop, counts):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor())
+    body = urllib.parse.urlencode({'username': f'bench{index % USERS}', 'password': PASSWORD}).encode()
+    while not stop.is_set():
+        try:
+            opener.open(base + '/login', data=body, timeout=30).read()
+            counts['ok'] += 1
+        except urllib.error.HTTPError as e:
+            e.close()
+            counts['busy' if e.code == 503 else 'error'] += 1
+            # A browser user would retry after a moment, not in a tight loop
+            time.sleep(float(e.headers.get('Retry-After', 1)))
+
+
+def run(mode, seconds, clients):
+    with tempfile.TemporaryDirectory() as tmp:
+        port = _free_port()
+        env = dict(os.environ,
+                   DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                   BIND=f'127.0.0.1:{port}',
+                   WEB_CONCURRENCY='2',
+                   HASH_POOL_SIZE='0' if mode == 'inline' else '1')
+        subprocess.run([sys.executable, '-c', SEED, PASSWORD, str(USERS)], env=env, cwd=HERE, check=True)
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], env=env, cwd=HERE,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base = f'http://127.0.0.1:{port}'
+        try:
+            _wait_up(base)
+            result = {}
+
+            stop = threading.Event()
+            timer = threading.Timer(seconds / 2, stop.set)
+            timer.start()
+            result['idle'] = _feed_latencies(base, stop)
+
+            stop = threading.Event()
+            counts = {'ok': 0, 'busy': 0, 'error': 0}
+            storm = [threading.Thread(target=_login_storm, args=(base, i, stop, counts)) for i in range(clients)]
+            for t in storm:
+                t.start()
+            time.sleep(1)  # let the storm build up
+            threading.Timer(seconds, stop.set).start()
+            result['storm'] = _feed_latencies(base, stop)
+            for t in storm:
+                t.join()
+            result['logins'] = counts
+            return result
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    print(f"feed GET / latency (ms), {clients} login clients, {seconds:.0f}s per phase\n")
+    print(f"{'mode':<8}{'phase':<8}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}   logins ok/503/err")
+    for mode in ('inline', 'pool'):
+        result = run(mode, seconds, clients)
+        for phase in ('idle', 'storm'):
+            lat = [v * 1000 for v in result[phase]]
+            extra = ''
+            if phase == 'storm':
+                c = result['logins']
+                extra = f"   {c['ok']}/{c['busy']}/{c['error']}"
+            print(f"{mode:<8}{phase:<8}{statistics.median(lat):8.1f}{_percentile(lat, 95):8.1f}"
+                  f"{_percentile(lat, 99):8.1f}{max(lat):8.1f}{extra}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Startup and first-request latency, with and without the warm-up phase.
+
+    python bench_startup.py
+
+Each run is a fresh interpreter against a throwaway database, so import,
+create_app() and the first requests are measured cold.
+"""
+import os
+import sys
+import json
+import subprocess
+import tempfile
+
+PROBE = r'''
+import json, time
+t0 = time.perf_counter()
+from wsgi import app
+from models import db, User, Post, Comment, PostCategory
+from datetime import datetime
+t1 = time.perf_counter()
+
+with app.app_context():
+    user = User(username='bench', agreed_kvkk=datetime.utcnow(), password_hash='x')
+    post = Post(title='Bench', content='İçerik', category=PostCategory.GENERAL, author=user)
+    db.session.add(post)
+    for i in range(50):
+        db.session.add(Comment(content=f'Yorum {i}', author=user, post=post, created_at=datetime.utcnow()))
+    db.session.commit()
+    post_id = post.id
+
+client = app.test_client()
+timings = {'startup': t1 - t0}
+for label, url in [('index', '/'), ('register', '/register'), ('post', f'/post/{post_id}')]:
+    s = time.perf_counter(); client.get(url); timings[label + '_first'] = time.perf_counter() - s
+    s = time.perf_counter(); client.get(url); timings[label + '_second'] = time.perf_counter() - s
+print(json.dumps(timings))
+'''
+
+def run(warm):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                   WARM_STARTUP='1' if warm else '0')
+        out = subprocess.run([sys.executable, '-c', PROBE], env=env, capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    results = {'cold': run(warm=False), 'warm': run(warm=True)}
+    print(f"{'':<18}{'cold':>10}{'warm':>10}   (ms)")
+    for key in results['cold']:
+        print(f"{key:<18}{results['cold'][key] * 1000:10.1f}{results['warm'][key] * 1000:10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Storage and lookup comparison: post_view table vs viewer bitmaps.
+
+    python bench_views.py [users] [posts] [views_per_post]
+
+Builds both layouts in throwaway SQLite files and prints file sizes and
+"has this user viewed this post" latency for each.
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+from viewstore import ViewerBitmap, HyperLogLog, KEEP_SKETCH
+
+def build_table(path, views):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE post_view (
+        id INTEGER NOT NULL PRIMARY KEY, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+        timestamp DATETIME, CONSTRAINT unique_post_view UNIQUE (post_id, user_id))""")
+    conn.executemany("INSERT INTO post_view (post_id, user_id, timestamp) VALUES (?, ?, CURRENT_TIMESTAMP)",
+                     ((p, u) for p, users in views.items() for u in users))
+    conn.commit()
+    conn.execute("VACUUM")
+    return conn
+
+def build_bitmaps(path, views):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE post_viewers (
+        post_id INTEGER NOT NULL PRIMARY KEY, bitmap BLOB NOT NULL, sketch BLOB,
+        viewer_count INTEGER NOT NULL, version INTEGER NOT NULL, updated_at DATETIME)""")
+    bitmaps = {}
+    for post_id, users in views.items():
+        bm = ViewerBitmap()
+        hll = HyperLogLog()
+        for u in users:
+            bm.add(u)
+            hll.add(u)
+        bitmaps[post_id] = bm
+        # Same row as production, sketch included when viewstore keeps one
+        conn.execute("INSERT INTO post_viewers VALUES (?, ?, ?, ?, 1, CURRENT_TIMESTAMP)",
+                     (post_id, bm.to_bytes(), hll.to_bytes() if KEEP_SKETCH else None, len(bm)))
+    conn.commit()
+    conn.execute("VACUUM")
+    return conn, bitmaps
+
+def timed(label, fn, probes):
+    start = time.perf_counter()
+    hits = sum(1 for p, u in probes if fn(p, u))
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed / len(probes) * 1e6:8.2f} us/lookup  ({hits} hits)")
+
+def main(users=20000, posts=500, views_per_post=2000):
+    rng = random.Random(42)
+    views = {p: rng.sample(range(1, users + 1), min(views_per_post, users)) for p in range(1, posts + 1)}
+    total = sum(len(v) for v in views.values())
+    probes = [(rng.randint(1, posts), rng.randint(1, users)) for _ in range(20000)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        table_path = os.path.join(tmp, 'table.db')
+        bitmap_path = os.path.join(tmp, 'bitmap.db')
+
+        table_conn = build_table(table_path, views)
+        bitmap_conn, bitmaps = build_bitmaps(bitmap_path, views)
+
+        print(f"{total} unique views ({posts} posts, {users} users)")
+        print("Storage")
+        print(f"  post_view table              {os.path.getsize(table_path) / 1024:10.1f} KB")
+        print(f"  post_viewers bitmap+sketch   {os.path.getsize(bitmap_path) / 1024:10.1f} KB")
+
+        print("Lookup")
+        timed("post_view indexed query", lambda p, u: table_conn.execute(
+            "SELECT 1 FROM post_view WHERE post_id = ? AND user_id = ?", (p, u)).fetchone() is not None, probes)
+        timed("bitmap, cold (load blob)", lambda p, u: u in ViewerBitmap.from_bytes(bitmap_conn.execute(
+            "SELECT bitmap FROM post_viewers WHERE post_id = ?", (p,)).fetchone()[0]), probes[:2000])
+        timed("bitmap, from memory", lambda p, u: u in bitmaps[p], probes)
+
+        table_conn.close()
+        bitmap_conn.close()
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:4]])
@@ -0,0 +1,512 @@
+"""
+Bulk import of content from the old forum.
+
+    python bulk_import.py DIR [--chunk 5000] [--workers N] [--drop-indexes] [--merge-usernames] [--backup]
+
+DIR holds users, posts, comments and votes as <name>.jsonl or <name>.csv
+(any of them may be missing); they are imported in that order:
+
+    users     id, username, [password_hash, university, position, bio, created_at]
+    posts     id, author_id, title, content, [category, created_at]
+    comments  id, post_id, author_id, content, [parent_id, created_at]
+    votes     post_id, user_id, value, [timestamp]
+
+Ids are the old forum's: every row gets a fresh id here and references are
+remapped. A username that already exists here is skipped as a conflict
+(and with it that account's content); --merge-usernames maps it onto the
+local account instead, except for admins. Imported accounts have no KVKK
+consent yet (agreed_kvkk NULL) and are asked for it at login. Rows with
+profanity (checked in a process pool while the previous chunk is being
+written), invalid values or references to skipped rows are left out and
+counted. Password hashes in werkzeug format are kept; other accounts get an
+unusable hash.
+
+Each chunk is one BEGIN IMMEDIATE transaction of executemany INSERTs.
+--drop-indexes drops the secondary indexes of the target tables for the run
+and rebuilds them at the end (large imports into a quiet site). Their CREATE
+statements are saved in the bulk_import_index table in the same transaction
+as the drop, so an import that dies halfway leaves them to be recreated by
+the next run or by maintenance.py. Afterwards the derived data is brought
+up to date: analytics rollups, duplicate signatures, the related-posts
+index and the feeds.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import multiprocessing
+from collections import Counter
+from datetime import datetime, timezone
+
+from app import create_app, db
+from models import PostCategory
+from utils import contains_profanity
+import analytics
+import backup
+import universities
+from related import related_index
+from dedupe import dedupe_index
+from feeds import feed_store
+
+CHUNK = 5000
+ENTITIES = ('users', 'posts', 'comments', 'votes')
+TABLES = ('user', 'post', 'comment', 'vote')
+UNUSABLE_PASSWORD = '!imported'
+PASSWORD_PREFIXES = ('scrypt:', 'pbkdf2:')
+
+
+# --------------------
+# INPUT
+# --------------------
+
+def find_source(directory, entity):
+    for ext in ('jsonl', 'csv'):
+        path = os.path.join(directory, f"{entity}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_rows(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _key(value):
+    # Old ids arrive as ints from JSONL and strings from CSV
+    return None if value in (None, '') else str(value)
+
+
+def _text(value):
+    value = (value or '').strip() if isinstance(value, str) else value
+    return value or None
+
+
+def _when(value):
+    if value:
+        try:
+            dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+            if dt.tzinfo:
+                dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+            return dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+        except ValueError:
+            pass
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _category(value):
+    try:
+        return PostCategory((value or 'general').lower()).name
+    except ValueError:
+        return None
+
+
+# --------------------
+# PROFANITY (process pool)
+# --------------------
+
+TEXTS = {
+    'users': lambda r: (r.get('username'), r.get('university'), r.get('bio')),
+    'posts': lambda r: (r.get('title'), r.get('content')),
+    'comments': lambda r: (r.get('content'),),
+    'votes': lambda r: (),
+}
+
+
+def _flagged(rows):
+    return [any(contains_profanity(t) for t in texts if isinstance(t, str)) for texts in rows]
+
+
+def _submit(pool, texts, workers):
+    if pool is None:
+        return _flagged(texts)
+    step = max(1, -(-len(texts) // workers))
+    return pool.map_async(_flagged, [texts[i:i + step] for i in range(0, len(texts), step)])
+
+
+def _collect(job):
+    return job if isinstance(job, list) else [flag for part in job.get() for flag in part]
+
+
+def checked(chunks, texts_of, pool, workers):
+    """Yields (chunk, flags); the next chunk is checked while this one is written."""
+    pending = None
+    for chunk in chunks:
+        job = _submit(pool, [texts_of(r) for r in chunk], workers)
+        if pending:
+            yield pending[0], _collect(pending[1])
+        pending = (chunk, job)
+    if pending:
+        yield pending[0], _collect(pending[1])
+
+
+# --------------------
+# WRITING
+# --------------------
+
+class Stats:
+    def __init__(self, entity):
+        self.entity = entity
+        self.read = 0
+        self.inserted = 0
+        self.merged = 0
+        self.skipped = Counter()
+        self.seconds = 0.0
+
+    def __str__(self):
+        rate = self.read / self.seconds if self.seconds else 0
+        skipped = ', '.join(f"{reason} {n}" for reason, n in self.skipped.most_common())
+        return (f"{self.entity:<9} read {self.read:>8}  inserted {self.inserted:>8}  merged {self.merged:>6}  "
+                f"skipped {sum(self.skipped.values()):>6}{f' ({skipped})' if skipped else ''}  "
+                f"{self.seconds:7.2f}s  {rate:>9.0f} rows/s")
+
+
+class Importer:
+    def __init__(self, sqlite, chunk=CHUNK, merge_usernames=False):
+        self.sqlite = sqlite
+        self.chunk = chunk
+        self.merge_usernames = merge_usernames
+        self.users, self.posts, self.comments = {}, {}, {}
+        self.banned = {r[0] for r in sqlite.execute("SELECT id FROM user WHERE is_banned = 1")}
+        self.universities = {}
+
+    def _next_id(self, table):
+        return self.sqlite.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").fetchone()[0]
+
+    def _write(self, sql, rows):
+        # One short write transaction per chunk
+        self.sqlite.execute("BEGIN IMMEDIATE")
+        try:
+            result = rows(self) if callable(rows) else rows
+            if result:
+                self.sqlite.executemany(sql, result)
+            self.sqlite.execute("COMMIT")
+        except BaseException:
+            self.sqlite.execute("ROLLBACK")
+            raise
+        return result
+
+    def _resolve_universities(self, chunk):
+        # ORM session, committed before the chunk's raw transaction starts
+        for row in chunk:
+            value = _text(row.get('university'))
+            if value and value not in self.universities:
+                uni = universities.resolve(value)
+                self.universities[value] = uni.id if uni else None
+        db.session.commit()
+
+    def users_chunk(self, chunk, flags, stats):
+        self._resolve_universities(chunk)
+
+        def rows(self):
+            base = self._next_id('user')
+            names = [_text(r.get('username')) for r in chunk]
+            existing = {name: (uid, is_admin) for name, uid, is_admin in self.sqlite.execute(
+                f"SELECT username, id, is_admin FROM user WHERE username IN ({','.join('?' * len(names))})", names)}
+            out = []
+            for row, name, bad in zip(chunk, names, flags):
+                old = _key(row.get('id'))
+                if not name or len(name) > 80 or old is None:
+                    stats.skipped['invalid'] += 1
+                elif bad:
+                    stats.skipped['profanity'] += 1
+                elif name in existing:
+                    # Same username is no proof of same person: never merge
+                    # silently, and never onto an admin
+                    uid, is_admin = existing[name]
+                    if self.merge_usernames and not is_admin:
+                        self.users[old] = uid
+                        stats.merged += 1
+                    else:
+                        stats.skipped['conflict'] += 1
+                else:
+                    new_id = base + len(out)
+                    self.users[old] = new_id
+                    existing[name] = (new_id, False)
+                    password = _text(row.get('password_hash')) or ''
+                    if not password.startswith(PASSWORD_PREFIXES):
+                        password = UNUSABLE_PASSWORD
+                    university = _text(row.get('university'))
+                    created = _when(row.get('created_at'))
+                    # agreed_kvkk stays NULL: consent is asked at their first login here
+                    out.append((new_id, name, password, university, self.universities.get(university),
+                                _text(row.get('position')), _text(row.get('bio')), created))
+            return out
+
+        written = self._write(
+            "INSERT INTO user (id, username, password_hash, university, university_id, position, bio, "
+            "agreed_kvkk, created_at, is_admin, is_verified, is_banned, profile_image) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?, 0, 0, 0, 'default.png')", rows)
+        stats.inserted += len(written)
+
+    def posts_chunk(self, chunk, flags, stats):
+        def rows(self):
+            base = self._next_id('post')
+            out = []
+            for row, bad in zip(chunk, flags):
+                old = _key(row.get('id'))
+                author = self.users.get(_key(row.get('author_id')))
+                title, content = _text(row.get('title')), _text(row.get('content'))
+                category = _category(row.get('category'))
+                if old is None or not title or not content or category is None:
+                    stats.skipped['invalid'] += 1
+                elif author is None:
+                    stats.skipped['missing author'] += 1
+                elif bad:
+                    stats.skipped['profanity'] += 1
+                else:
+                    new_id = self.posts[old] = base + len(out)
+                    out.append((new_id, title[:200], content, author, _when(row.get('created_at')),
+                                category, 0 if author in self.banned else 1))
+            return out
+
+        written = self._write(
+            "INSERT INTO post (id, title, content, author_id, created_at, category, author_visible, view_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 0)", rows)
+        stats.inserted += len(written)
+
+    def comments_chunk(self, chunk, flags, stats):
+        """Returns the (row, flag) pairs whose parent has not been imported yet."""
+        deferred = []
+
+        def rows(self):
+            base = self._next_id('comment')
+            out = []
+            for row, bad in zip(chunk, flags):
+                old = _key(row.get('id'))
+                post = self.posts.get(_key(row.get('post_id')))
+                author = self.users.get(_key(row.get('author_id')))
+                parent_key = _key(row.get('parent_id'))
+                content = _text(row.get('content'))
+                if old is None or not content:
+                    stats.skipped['invalid'] += 1
+                elif post is None:
+                    stats.skipped['missing post'] += 1
+                elif author is None:
+                    stats.skipped['missing author'] += 1
+                elif bad:
+                    stats.skipped['profanity'] += 1
+                elif parent_key is not None and parent_key not in self.comments:
+                    deferred.append((row, bad))
+                else:
+                    new_id = self.comments[old] = base + len(out)
+                    out.append((new_id, content, post, author, self.comments.get(parent_key),
+                                _when(row.get('created_at')), 0 if author in self.banned else 1))
+            return out
+
+        written = self._write(
+            "INSERT INTO comment (id, content, post_id, author_id, parent_id, created_at, author_visible, is_hidden) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 0)", rows)
+        stats.inserted += len(written)
+        return deferred
+
+    def votes_chunk(self, chunk, flags, stats):
+        def rows(self):
+            out = []
+            for row in chunk:
+                post = self.posts.get(_key(row.get('post_id')))
+                user = self.users.get(_key(row.get('user_id')))
+                try:
+                    value = int(row.get('value'))
+                except (TypeError, ValueError):
+                    value = None
+                if value not in (1, -1):
+                    stats.skipped['invalid'] += 1
+                elif post is None or user is None:
+                    stats.skipped['missing post/user'] += 1
+                else:
+                    out.append((user, post, value, _when(row.get('timestamp'))))
+            return out
+
+        before = self.sqlite.total_changes
+        written = self._write(
+            "INSERT OR IGNORE INTO vote (user_id, post_id, value, timestamp) VALUES (?, ?, ?, ?)", rows)
+        inserted = self.sqlite.total_changes - before
+        stats.inserted += inserted
+        stats.skipped['duplicate'] += len(written) - inserted
+
+    def run(self, entity, path, pool, workers):
+        stats = Stats(entity)
+        started = time.monotonic()
+        write = getattr(self, f"{entity}_chunk")
+        deferred = []
+        for chunk, flags in checked(chunked(read_rows(path), self.chunk), TEXTS[entity], pool, workers):
+            stats.read += len(chunk)
+            result = write(chunk, flags, stats)
+            if result:
+                deferred.extend(result)
+
+        # Replies that came before their parent: retry until nothing moves
+        while deferred:
+            retry, deferred = deferred, []
+            for part in chunked(retry, self.chunk):
+                deferred.extend(write([r for r, _ in part], [f for _, f in part], stats))
+            if len(deferred) == len(retry):
+                stats.skipped['missing parent'] += len(deferred)
+                break
+        stats.seconds = time.monotonic() - started
+        return stats
+
+
+# --------------------
+# INDEXES
+# --------------------
+
+# sqlite is a raw connection in autocommit mode (isolation_level None)
+
+def _saved_indexes_table(sqlite):
+    sqlite.execute("CREATE TABLE IF NOT EXISTS bulk_import_index (name TEXT PRIMARY KEY, sql TEXT NOT NULL)")
+
+
+def drop_indexes(sqlite):
+    """
+    Drops the non-unique secondary indexes of TABLES, saving their CREATE
+    statements in bulk_import_index first. Returns how many were dropped.
+    """
+    _saved_indexes_table(sqlite)
+    sqlite.execute("BEGIN IMMEDIATE")
+    try:
+        rows = sqlite.execute(
+            f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+            f"AND tbl_name IN ({','.join('?' * len(TABLES))})", TABLES).fetchall()
+        dropped = 0
+        for name, sql in rows:
+            if sql.upper().startswith('CREATE UNIQUE'):
+                continue
+            sqlite.execute("INSERT OR REPLACE INTO bulk_import_index (name, sql) VALUES (?, ?)", (name, sql))
+            sqlite.execute(f'DROP INDEX "{name}"')
+            dropped += 1
+        sqlite.execute("COMMIT")
+    except BaseException:
+        sqlite.execute("ROLLBACK")
+        raise
+    return dropped
+
+
+def restore_indexes(sqlite):
+    """Recreates the indexes saved by drop_indexes(); returns how many."""
+    _saved_indexes_table(sqlite)
+    saved = sqlite.execute("SELECT name, sql FROM bulk_import_index ORDER BY name").fetchall()
+    for name, sql in saved:
+        # One transaction per index: a crash here loses nothing either
+        sqlite.execute("BEGIN IMMEDIATE")
+        try:
+            exists = sqlite.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+                                    (name,)).fetchone()
+            if not exists:
+                sqlite.execute(sql)
+            sqlite.execute("DELETE FROM bulk_import_index WHERE name = ?", (name,))
+            sqlite.execute("COMMIT")
+        except BaseException:
+            sqlite.execute("ROLLBACK")
+            raise
+    if saved:
+        for table in TABLES:
+            sqlite.execute(f'ANALYZE "{table}"')
+    return len(saved)
+
+
+# --------------------
+# MAIN
+# --------------------
+
+def bulk_import(directory, chunk=CHUNK, workers=None, drop_secondary=False, merge_usernames=False,
+                take_backup=False):
+    workers = os.cpu_count() if workers is None else workers
+    sources = {e: find_source(directory, e) for e in ENTITIES}
+    if not any(sources.values()):
+        print(f"No users/posts/comments/votes .jsonl or .csv files in {directory}")
+        return []
+
+    # The derived indexes are rebuilt at the end anyway
+    app = create_app({'WARM_STARTUP': False})
+    with app.app_context():
+        db.create_all()
+        if take_backup:
+            backup.backup(db.engine.url.database)
+
+        # Forked before the import connection is opened
+        pool = multiprocessing.get_context('fork').Pool(workers) if workers > 1 else None
+        raw = db.engine.raw_connection()
+        sqlite = raw.driver_connection
+        isolation = sqlite.isolation_level
+        sqlite.isolation_level = None  # transactions are explicit (Importer._write)
+        results, dropped = [], 0
+        try:
+            leftover = restore_indexes(sqlite)
+            if leftover:
+                print(f"{leftover} indexes left dropped by an earlier run recreated")
+            if drop_secondary:
+                dropped = drop_indexes(sqlite)
+            importer = Importer(sqlite, chunk, merge_usernames)
+            for entity in ENTITIES:
+                if sources[entity]:
+                    stats = importer.run(entity, sources[entity], pool, workers)
+                    print(stats)
+                    results.append(stats)
+        finally:
+            if dropped:
+                started = time.monotonic()
+                restore_indexes(sqlite)
+                print(f"{dropped} indexes rebuilt in {time.monotonic() - started:.2f}s")
+            sqlite.isolation_level = isolation
+            raw.close()
+            if pool:
+                pool.close()
+                pool.join()
+
+        started = time.monotonic()
+        analytics.run_rollup()
+        dedupe_index.backfill()
+        related_index.build()
+        feed_store.catch_up()
+        feed_store.invalidate()
+        universities.directory.invalidate()
+        print(f"derived indexes updated in {time.monotonic() - started:.2f}s")
+
+    total = sum(s.read for s in results)
+    seconds = sum(s.seconds for s in results)
+    if seconds:
+        print(f"total: {total} rows in {seconds:.2f}s, {total / seconds:.0f} rows/s")
+    return results
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    def option(name, default):
+        if name in args:
+            i = args.index(name)
+            value = args[i + 1]
+            del args[i:i + 2]
+            return int(value)
+        return default
+
+    chunk = option('--chunk', CHUNK)
+    workers = option('--workers', None)
+    drop_secondary = '--drop-indexes' in args
+    merge_usernames = '--merge-usernames' in args
+    take_backup = '--backup' in args
+    args = [a for a in args if not a.startswith('--')]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    bulk_import(args[0], chunk=chunk, workers=workers, drop_secondary=drop_secondary,
+                merge_usernames=merge_usernames, take_backup=take_backup)
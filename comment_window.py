@@ -0,0 +1,115 @@
+"""
+Windowed comment threads.
+
+post_detail renders the newest TOP_WINDOW top-level comments. Under each
+comment it shows up to REPLY_WINDOW of the oldest replies, prefetched
+PREFETCH_DEPTH levels deep. The rest is fetched on demand with keyset
+cursors over (created_at, id). Every query is a range scan of
+ix_comment_visible_thread (post_id, parent_id, created_at).
+"""
+from datetime import datetime
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import joinedload
+from models import db, Comment
+
+TOP_WINDOW = 20
+REPLY_WINDOW = 3
+PREFETCH_DEPTH = 2
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(comment):
+    return f"{comment.created_at.isoformat()}_{comment.id}"
+
+
+def decode_cursor(cursor):
+    try:
+        stamp, comment_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(stamp), int(comment_id)
+    except (AttributeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def _visible(post_id):
+    return Comment.query.options(joinedload(Comment.author)).filter(
+        Comment.post_id == post_id,
+        Comment.author_visible == True,
+    )
+
+
+def top_level(post_id, cursor=None, limit=TOP_WINDOW):
+    """(comments, next_cursor): top-level comments, newest first."""
+    q = _visible(post_id).filter(Comment.parent_id.is_(None))
+    if cursor:
+        q = q.filter(tuple_(Comment.created_at, Comment.id) < decode_cursor(cursor))
+    rows = q.order_by(Comment.created_at.desc(), Comment.id.desc()).limit(limit + 1).all()
+    return rows[:limit], encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+
+
+def replies(post_id, parent_id, cursor=None, limit=REPLY_WINDOW * 5):
+    """(comments, next_cursor): replies to one comment, oldest first."""
+    q = _visible(post_id).filter(Comment.parent_id == parent_id)
+    if cursor:
+        q = q.filter(tuple_(Comment.created_at, Comment.id) > decode_cursor(cursor))
+    rows = q.order_by(Comment.created_at, Comment.id).limit(limit + 1).all()
+    return rows[:limit], encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+
+
+def reply_windows(post_id, parent_ids, limit=REPLY_WINDOW):
+    """
+    First `limit` replies of every parent in one query (ROW_NUMBER per
+    parent). Returns {parent_id: (replies, more)}; more is True when
+    further replies exist. limit=0 only checks whether any exist.
+    """
+    if not parent_ids:
+        return {}
+    rn = func.row_number().over(
+        partition_by=Comment.parent_id,
+        order_by=(Comment.created_at, Comment.id),
+    ).label('rn')
+    ranked = db.session.query(Comment.id.label('id'), rn).filter(
+        Comment.post_id == post_id,
+        Comment.parent_id.in_(parent_ids),
+        Comment.author_visible == True,
+    ).subquery()
+    rows = _visible(post_id).join(ranked, ranked.c.id == Comment.id) \
+        .filter(ranked.c.rn <= limit + 1) \
+        .order_by(Comment.parent_id, Comment.created_at, Comment.id).all()
+
+    windows = {}
+    for row in rows:
+        windows.setdefault(row.parent_id, []).append(row)
+    return {pid: (items[:limit], len(items) > limit) for pid, items in windows.items()}
+
+
+def load_thread(post_id, comments, depth=PREFETCH_DEPTH):
+    """
+    {comment_id: (replies, next_cursor, more)} for the comments and their
+    prefetched descendants, as used by the render_comment macro.
+    next_cursor is None with more=True when replies exist but none were
+    loaded yet (start from the beginning).
+    """
+    thread = {}
+    level = [c.id for c in comments]
+    for d in range(depth + 1):
+        limit = REPLY_WINDOW if d < depth else 0
+        windows = reply_windows(post_id, level, limit)
+        level = []
+        for parent_id, (items, more) in windows.items():
+            cursor = encode_cursor(items[-1]) if more and items else None
+            thread[parent_id] = (items, cursor, more)
+            level.extend(c.id for c in items)
+        if not level:
+            break
+    return thread
+
+
+def top_level_count(post_id):
+    return db.session.query(func.count(Comment.id)).filter(
+        Comment.post_id == post_id,
+        Comment.parent_id.is_(None),
+        Comment.author_visible == True,
+    ).scalar()
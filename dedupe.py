@@ -0,0 +1,230 @@
+"""
+Near-duplicate post detection with MinHash + LSH.
+
+Every post gets a 128-value MinHash signature of its character shingles,
+stored in PostSignature and indexed in memory by 32 bands of 4 rows. A new
+post is only compared with posts that share at least one band bucket, so
+a check does not scan the corpus.
+
+    python dedupe.py [threshold]    # backfill signatures, print clusters
+"""
+import re
+import sys
+import zlib
+import threading
+import numpy as np
+from sqlalchemy import text, bindparam
+from models import db, PostSignature
+from related import turkish_lower
+
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+SHINGLE = 5
+
+# Estimated Jaccard similarity at which a new post is flagged for admins / refused
+FLAG_THRESHOLD = 0.7
+REJECT_THRESHOLD = 0.9
+
+_PRIME = 4294967291  # largest prime below 2**32
+_rng = np.random.RandomState(20240601)  # fixed: stored signatures must stay comparable
+_A = _rng.randint(1, 2 ** 31, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, 2 ** 31, size=NUM_PERM).astype(np.uint64)
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def shingles(title, content):
+    normalized = _NON_WORD.sub(' ', turkish_lower(f"{title or ''} {content or ''}")).strip()
+    if len(normalized) <= SHINGLE:
+        grams = {normalized}
+    else:
+        grams = {normalized[i:i + SHINGLE] for i in range(len(normalized) - SHINGLE + 1)}
+    return np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def signature(title, content):
+    x = shingles(title, content)
+    # a < 2**31 and x < 2**32, so a*x + b stays inside uint64
+    hashed = (_A[:, None] * x[None, :] + _B[:, None]) % _PRIME
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def similarity(sig_a, sig_b):
+    return float(np.count_nonzero(sig_a == sig_b)) / NUM_PERM
+
+
+def _band_keys(sig):
+    return [sig[b * ROWS:(b + 1) * ROWS].tobytes() for b in range(BANDS)]
+
+
+class DuplicateIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.signatures = {}
+        self.bands = [dict() for _ in range(BANDS)]
+        # id of the newest row loaded. post_signature.id is AUTOINCREMENT and
+        # assigned inside the write transaction, and SQLite has one writer at
+        # a time, so ids grow in commit order: a row committed by another
+        # worker can't land below the watermark the way a created_at can.
+        self.watermark = 0
+
+    def _insert(self, post_id, sig):
+        old = self.signatures.get(post_id)
+        if old is not None:
+            if np.array_equal(old, sig):
+                return
+            self.remove(post_id)
+        self.signatures[post_id] = sig
+        for band, key in zip(self.bands, _band_keys(sig)):
+            band.setdefault(key, []).append(post_id)
+
+    def remove(self, post_id):
+        with self._lock:
+            sig = self.signatures.pop(post_id, None)
+            if sig is None:
+                return
+            for band, key in zip(self.bands, _band_keys(sig)):
+                bucket = band.get(key)
+                if bucket and post_id in bucket:
+                    bucket.remove(post_id)
+                    if not bucket:
+                        del band[key]
+
+    def refresh(self, chunk=5000):
+        """Loads signatures written since the last call (by any worker)."""
+        with self._lock:
+            while True:
+                with db.engine.connect() as conn:
+                    rows = conn.execute(text(
+                        "SELECT id, post_id, signature FROM post_signature "
+                        "WHERE id > :last ORDER BY id LIMIT :n"
+                    ), {'last': self.watermark, 'n': chunk}).all()
+                for _, post_id, blob in rows:
+                    self._insert(post_id, np.frombuffer(blob, dtype=np.uint32))
+                if rows:
+                    self.watermark = rows[-1][0]
+                if len(rows) < chunk:
+                    break
+
+    def candidates(self, sig):
+        found = set()
+        for band, key in zip(self.bands, _band_keys(sig)):
+            found.update(band.get(key, ()))
+        return found
+
+    def check(self, sig, threshold=FLAG_THRESHOLD):
+        """[(post_id, similarity)] above threshold, best first."""
+        with self._lock:
+            self.refresh()
+            scored = []
+            for post_id in self.candidates(sig):
+                score = similarity(sig, self.signatures[post_id])
+                if score >= threshold:
+                    scored.append((post_id, score))
+        if not scored:
+            return []
+        # Posts deleted through another worker may still be indexed here
+        alive = {r[0] for r in db.session.execute(
+            text("SELECT id FROM post WHERE id IN :ids").bindparams(bindparam('ids', expanding=True)),
+            {'ids': [pid for pid, _ in scored]}
+        )}
+        for post_id, _ in scored:
+            if post_id not in alive:
+                self.remove(post_id)
+        return sorted(((p, s) for p, s in scored if p in alive), key=lambda m: -m[1])
+
+    def record(self, post, sig, match=None):
+        """Persists the signature of a new post (in the caller's transaction)."""
+        db.session.add(PostSignature(
+            post_id=post.id,
+            signature=sig.tobytes(),
+            duplicate_of_id=match[0] if match else None,
+            similarity=match[1] if match else None,
+        ))
+
+    # --------------------
+    # BATCH
+    # --------------------
+
+    def backfill(self, chunk=1000):
+        """Signs every post that has no signature yet. Returns the count."""
+        done, last = 0, 0
+        while True:
+            # NOT EXISTS is a rowid probe per post; a LEFT JOIN here gets
+            # planned as a scan of post_signature when its stats are stale
+            rows = db.session.execute(text(
+                "SELECT p.id, p.title, p.content FROM post p WHERE p.id > :last "
+                "AND NOT EXISTS (SELECT 1 FROM post_signature s WHERE s.post_id = p.id) "
+                "ORDER BY p.id LIMIT :n"
+            ), {'last': last, 'n': chunk}).all()
+            if not rows:
+                return done
+            for post_id, title, content in rows:
+                db.session.add(PostSignature(post_id=post_id, signature=signature(title, content).tobytes()))
+            db.session.commit()
+            done += len(rows)
+            last = rows[-1][0]
+
+    def clusters(self, threshold=FLAG_THRESHOLD):
+        """Groups of post ids whose pairwise-linked similarity is >= threshold."""
+        with self._lock:
+            self._reset()
+            self.refresh()
+            parent = {}
+
+            def find(x):
+                while parent[x] != x:
+                    parent[x] = parent[parent[x]]
+                    x = parent[x]
+                return x
+
+            def union(a, b):
+                parent.setdefault(a, a)
+                parent.setdefault(b, b)
+                ra, rb = find(a), find(b)
+                if ra != rb:
+                    parent[max(ra, rb)] = min(ra, rb)
+
+            checked = set()
+            for band in self.bands:
+                for bucket in band.values():
+                    if len(bucket) < 2:
+                        continue
+                    # Huge buckets (boilerplate text) are compared with their first member only
+                    pairs = ((a, b) for i, a in enumerate(bucket) for b in bucket[i + 1:]) \
+                        if len(bucket) <= 50 else ((bucket[0], b) for b in bucket[1:])
+                    for a, b in pairs:
+                        key = (a, b) if a < b else (b, a)
+                        if key in checked:
+                            continue
+                        checked.add(key)
+                        if similarity(self.signatures[a], self.signatures[b]) >= threshold:
+                            union(a, b)
+
+            groups = {}
+            for post_id in parent:
+                groups.setdefault(find(post_id), set()).add(post_id)
+            return sorted((sorted(g) for g in groups.values() if len(g) > 1), key=lambda g: (-len(g), g[0]))
+
+
+dedupe_index = DuplicateIndex()
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from models import Post
+    app = create_app({'WARM_STARTUP': False})
+
+    threshold = float(sys.argv[1]) if len(sys.argv) > 1 else FLAG_THRESHOLD
+    with app.app_context():
+        db.create_all()
+        print(f"{dedupe_index.backfill()} gonderi imzalandi.")
+        groups = dedupe_index.clusters(threshold)
+        for group in groups:
+            titles = [db.session.get(Post, pid).title for pid in group]
+            print(f"- {group}: {titles}")
+        print(f"{len(groups)} tekrar kumesi bulundu (esik {threshold}).")
@@ -0,0 +1,218 @@
+"""
+Live post updates over Server-Sent Events.
+
+An in-process broker keeps one bounded queue per open stream. Events are
+fanned out to the other gunicorn workers through Unix datagram sockets,
+one per worker process, under instance/events/: publishing sends one
+datagram to every socket there, and each worker's receiver thread
+hands it to its local subscribers.
+
+A subscriber that falls SUBSCRIBER_QUEUE events behind is dropped with a
+'resync' event; the browser reconnects and gets a fresh snapshot.
+"""
+import os
+import json
+import time
+import queue
+import random
+import socket
+import threading
+
+SUBSCRIBER_QUEUE = 64
+HEARTBEAT_SECONDS = 15
+MAX_STREAM_SECONDS = 300  # EventSource reconnects by itself
+# Under gthread every open stream holds a worker thread. gunicorn.conf.py
+# sets this from the worker's thread budget, next to HASH_MAX_PENDING.
+MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 4))
+# Reconnect delay sent to clients turned away by a full worker, plus jitter
+BUSY_RETRY_MS = 20000
+MAX_DATAGRAM = 60 * 1024
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, broker, post_id):
+        self.broker = broker
+        self.post_id = post_id
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self.overflowed = False
+        self.closed = False
+
+    def offer(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.overflowed = True
+
+    def close(self):
+        # Called by the stream's finally and by the response's close; the
+        # slot is given back once.
+        if not self.closed:
+            self.closed = True
+            self.broker.unsubscribe(self)
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    for line in json.dumps(data, ensure_ascii=False).splitlines():
+        lines.append(f"data: {line}")
+    return '\n'.join(lines) + '\n\n'
+
+
+class Broker:
+    def __init__(self, root=None):
+        self.root = root
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._count = 0
+        self._pid = None
+        self._receiver = None
+        self._sender = None
+
+    def init_app(self, app):
+        self.root = os.path.join(app.instance_path, 'events')
+
+    # --------------------
+    # LOCAL
+    # --------------------
+
+    def subscribe(self, post_id):
+        with self._lock:
+            if self._count >= MAX_STREAMS:
+                raise TooManyStreams()
+            sub = Subscription(self, post_id)
+            self._subscribers.setdefault(post_id, set()).add(sub)
+            self._count += 1
+        self._ensure_receiver()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.post_id)
+            if subs and sub in subs:
+                subs.discard(sub)
+                self._count -= 1
+                if not subs:
+                    del self._subscribers[sub.post_id]
+
+    def _deliver(self, post_id, item):
+        with self._lock:
+            subs = list(self._subscribers.get(post_id, ()))
+        for sub in subs:
+            sub.offer(item)
+
+    # --------------------
+    # CROSS-WORKER
+    # --------------------
+
+    def _socket_path(self, pid):
+        return os.path.join(self.root, f"{pid}.sock")
+
+    def _ensure_receiver(self):
+        # Bound lazily in the process that has subscribers; under --preload
+        # the master never subscribes and forked workers bind their own.
+        pid = os.getpid()
+        if self._pid == pid or self.root is None:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            path = self._socket_path(pid)
+            try:
+                os.unlink(path)  # left over from an old process with this pid
+            except FileNotFoundError:
+                pass
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            self._receiver = sock
+            self._pid = pid
+            threading.Thread(target=self._receive, args=(sock,), daemon=True).start()
+
+    def _receive(self, sock):
+        while True:
+            try:
+                payload = sock.recv(MAX_DATAGRAM + 1024)
+            except OSError:
+                return
+            try:
+                message = json.loads(payload)
+            except ValueError:
+                continue
+            self._deliver(message['post_id'], (message['event'], message['data'], message['id']))
+
+    def _broadcast(self, payload):
+        if self.root is None or not os.path.isdir(self.root):
+            return
+        if self._sender is None:
+            sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sender.setblocking(False)
+            self._sender = sender
+        own = f"{os.getpid()}.sock"
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name == own or not entry.name.endswith('.sock'):
+                    continue
+                try:
+                    self._sender.sendto(payload, entry.path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Worker is gone
+                    try:
+                        os.unlink(entry.path)
+                    except FileNotFoundError:
+                        pass
+                except BlockingIOError:
+                    pass  # receiver is backed up; its streams will resync
+
+    def publish(self, post_id, event, data):
+        event_id = str(time.time_ns() // 1000)
+        payload = json.dumps({'post_id': post_id, 'event': event, 'data': data, 'id': event_id},
+                             ensure_ascii=False).encode('utf-8')
+        if len(payload) > MAX_DATAGRAM:
+            # e.g. a very long comment: tell viewers to reload instead
+            event, data = 'stale', {}
+            payload = json.dumps({'post_id': post_id, 'event': event, 'data': data, 'id': event_id}).encode('utf-8')
+        self._deliver(post_id, (event, data, event_id))
+        self._broadcast(payload)
+
+    # --------------------
+    # STREAM
+    # --------------------
+
+    def stream(self, sub, snapshot=None):
+        """SSE text for one subscriber; ends after MAX_STREAM_SECONDS."""
+        deadline = time.monotonic() + MAX_STREAM_SECONDS
+        try:
+            yield "retry: 3000\n\n"
+            if snapshot is not None:
+                yield format_event('counts', snapshot)
+            while time.monotonic() < deadline:
+                if sub.overflowed:
+                    yield format_event('resync', {})
+                    return
+                try:
+                    event, data, event_id = sub.queue.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield format_event(event, data, event_id)
+        finally:
+            sub.close()
+
+
+def busy_stream():
+    """
+    Answer for a worker with no stream slot left. EventSource gives up for
+    good on an error status, but a 200 stream that only sets a longer retry
+    and ends makes it reconnect later, possibly to another worker.
+    """
+    yield f"retry: {BUSY_RETRY_MS + random.randint(0, BUSY_RETRY_MS // 2)}\n\n"
+
+
+broker = Broker()
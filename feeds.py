@@ -0,0 +1,326 @@
+"""
+Atom/RSS feeds and sitemaps, served from precompressed files.
+
+Everything lives under instance/feeds/:
+
+    atom-all.xml.gz, rss-all.xml.gz          newest FEED_SIZE posts
+    atom-<category>.xml.gz, rss-...          the same per PostCategory
+    sitemap-<n>.xml.gz                       posts with id in partition n
+    sitemap.xml.gz                           sitemap index over the partitions
+    dirty/<name>                             marker: <name> must be regenerated
+    state.json                               high-water mark (max post id seen)
+
+Post ids only grow, so a new post dirties the newest sitemap partition,
+the index and two feeds; older partitions are rewritten only when one of
+their own posts is deleted or hidden. Markers are plain files, so a
+change made in one gunicorn worker is picked up by all of them; the file
+is regenerated by whichever worker serves it next.
+
+ETags come from the file's size and mtime. Output is deterministic
+(gzip mtime=0) and unchanged content is not rewritten, so regenerating
+does not invalidate clients' copies.
+
+Links are built from the SITE_URL setting, never from the request's Host
+header: the files are shared by every client, so one forged Host would
+poison them all. Without SITE_URL the feeds and sitemaps are not served.
+"""
+import os
+import gzip
+import json
+import tempfile
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from xml.etree import ElementTree as ET
+from flask import Response, abort, request, url_for
+from sqlalchemy import func
+from models import db, Post, PostCategory
+
+FEED_SIZE = 50
+SUMMARY_LENGTH = 300
+# Well under the 50,000 URL limit; a partition is rebuilt in one query
+SITEMAP_PARTITION = 5000
+MAX_AGE = 300
+
+FEED_FORMATS = ('atom', 'rss')
+CATEGORY_TITLES = {
+    PostCategory.GENERAL: 'Genel',
+    PostCategory.QUESTION: 'Soru & Cevap',
+    PostCategory.ADVICE: 'Tavsiye',
+    PostCategory.EXPERIENCE: 'Deneyim',
+}
+SITE_TITLE = 'Akademi Platformu'
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+
+
+def partition_of(post_id):
+    return post_id // SITEMAP_PARTITION
+
+
+def _utc(value):
+    # Post.created_at is naive UTC
+    return value.isoformat(timespec='seconds') + 'Z'
+
+
+def _rfc822(value):
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def _replace(path, data):
+    # The temporary name is unique per call: the threads of one gthread
+    # worker share a pid, so a pid suffix alone lets two writers collide.
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.',
+                                     suffix='.tmp', delete=False) as f:
+        f.write(data)
+    try:
+        os.replace(f.name, path)
+    except OSError:
+        os.unlink(f.name)
+        raise
+
+
+def _summary(content):
+    content = ' '.join((content or '').split())
+    return content if len(content) <= SUMMARY_LENGTH else content[:SUMMARY_LENGTH].rstrip() + '…'
+
+
+class FeedStore:
+    def __init__(self, root=None):
+        self.root = root
+        self.site_url = None
+
+    def init_app(self, app):
+        self.root = os.path.join(app.instance_path, 'feeds')
+        os.makedirs(os.path.join(self.root, 'dirty'), exist_ok=True)
+        self.site_url = (app.config.get('SITE_URL') or '').rstrip('/') or None
+        if self.site_url is None:
+            app.logger.warning("SITE_URL is not set: feeds and sitemaps are disabled")
+
+    def _path(self, name):
+        return os.path.join(self.root, name + '.xml.gz')
+
+    def _marker(self, name):
+        return os.path.join(self.root, 'dirty', name)
+
+    # --------------------
+    # INVALIDATION
+    # --------------------
+
+    def mark(self, *names):
+        for name in names:
+            with open(self._marker(name), 'a'):
+                pass
+            os.utime(self._marker(name))
+
+    def _feed_names(self, category=None):
+        scopes = ['all'] + ([category.value] if category else [])
+        return [f"{fmt}-{scope}" for fmt in FEED_FORMATS for scope in scopes]
+
+    def mark_post(self, post_id, category):
+        """A post was created, deleted or changed visibility."""
+        self.mark(f"sitemap-{partition_of(post_id)}", 'sitemap', *self._feed_names(category))
+
+    def mark_author(self, user_id):
+        # Ban / unban flips author_visible on all their posts
+        rows = db.session.query(Post.id, Post.category).filter(Post.author_id == user_id).all()
+        partitions = {partition_of(post_id) for post_id, _ in rows}
+        categories = {category for _, category in rows}
+        names = [f"sitemap-{n}" for n in partitions] + ['sitemap'] if rows else []
+        for category in categories:
+            names += self._feed_names(category)
+        self.mark(*set(names))
+
+    def invalidate(self):
+        """Everything is regenerated on next request (bulk changes)."""
+        for name in os.listdir(self.root):
+            if name.endswith('.xml.gz'):
+                self.mark(name[:-len('.xml.gz')])
+
+    def _read_state(self):
+        try:
+            with open(os.path.join(self.root, 'state.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, state):
+        _replace(os.path.join(self.root, 'state.json'), json.dumps(state).encode('utf-8'))
+
+    def catch_up(self):
+        """
+        Marks what posts inserted outside the app (scripts, imports) have
+        made stale: every partition above the high-water mark.
+        """
+        state = self._read_state()
+        seen = state.get('max_post_id', 0)
+        max_id = db.session.query(func.max(Post.id)).scalar() or 0
+        if max_id == seen:
+            return
+        if max_id > seen:
+            first = partition_of(seen)
+            names = [f"sitemap-{n}" for n in range(first, partition_of(max_id) + 1)]
+        else:
+            # Newest posts were deleted behind our back
+            names = [f"sitemap-{partition_of(max_id)}", f"sitemap-{partition_of(seen)}"]
+        self.mark('sitemap', *names, *self._feed_names(),
+                  *(n for c in PostCategory for n in self._feed_names(c)))
+        state['max_post_id'] = max_id
+        self._write_state(state)
+
+    # --------------------
+    # GENERATION
+    # --------------------
+
+    def _url(self, endpoint, **values):
+        return self.site_url + url_for(endpoint, **values)
+
+    def _latest(self, category=None):
+        q = Post.query.filter(Post.author_visible == True)
+        if category:
+            q = q.filter(Post.category == category)
+        return q.order_by(Post.created_at.desc()).limit(FEED_SIZE).all()
+
+    def _atom(self, posts, title, self_url, page_url):
+        feed = ET.Element('feed', xmlns=ATOM_NS)
+        ET.SubElement(feed, 'title').text = title
+        ET.SubElement(feed, 'id').text = self_url
+        ET.SubElement(feed, 'link', rel='self', href=self_url)
+        ET.SubElement(feed, 'link', rel='alternate', href=page_url)
+        ET.SubElement(feed, 'updated').text = _utc(posts[0].created_at if posts else datetime(2000, 1, 1))
+        for post in posts:
+            link = self._url('main.view_post', post_id=post.id)
+            entry = ET.SubElement(feed, 'entry')
+            ET.SubElement(entry, 'title').text = post.title
+            ET.SubElement(entry, 'id').text = link
+            ET.SubElement(entry, 'link', rel='alternate', href=link)
+            ET.SubElement(entry, 'published').text = _utc(post.created_at)
+            ET.SubElement(entry, 'updated').text = _utc(post.created_at)
+            ET.SubElement(ET.SubElement(entry, 'author'), 'name').text = post.author.username
+            ET.SubElement(entry, 'category', term=post.category.value, label=CATEGORY_TITLES[post.category])
+            ET.SubElement(entry, 'summary').text = _summary(post.content)
+        return feed
+
+    def _rss(self, posts, title, self_url, page_url):
+        rss = ET.Element('rss', version='2.0')
+        channel = ET.SubElement(rss, 'channel')
+        ET.SubElement(channel, 'title').text = title
+        ET.SubElement(channel, 'link').text = page_url
+        ET.SubElement(channel, 'description').text = 'Üniversite ve akademik kariyer hakkında gerçek deneyimler.'
+        ET.SubElement(channel, 'language').text = 'tr'
+        if posts:
+            ET.SubElement(channel, 'lastBuildDate').text = _rfc822(posts[0].created_at)
+        for post in posts:
+            link = self._url('main.view_post', post_id=post.id)
+            item = ET.SubElement(channel, 'item')
+            ET.SubElement(item, 'title').text = post.title
+            ET.SubElement(item, 'link').text = link
+            ET.SubElement(item, 'guid', isPermaLink='true').text = link
+            ET.SubElement(item, 'pubDate').text = _rfc822(post.created_at)
+            ET.SubElement(item, 'category').text = CATEGORY_TITLES[post.category]
+            ET.SubElement(item, 'description').text = _summary(post.content)
+        return rss
+
+    def _feed(self, fmt, scope):
+        category = None if scope == 'all' else PostCategory(scope)
+        title = SITE_TITLE if category is None else f"{SITE_TITLE} - {CATEGORY_TITLES[category]}"
+        if category is None:
+            self_url = self._url('main.feed', fmt=fmt)
+            page_url = self._url('main.index')
+        else:
+            self_url = self._url('main.category_feed', category=scope, fmt=fmt)
+            page_url = self._url('main.index', cat=scope)
+        build = self._atom if fmt == 'atom' else self._rss
+        return build(self._latest(category), title, self_url, page_url)
+
+    def _sitemap(self, partition):
+        urlset = ET.Element('urlset', xmlns='http://www.sitemaps.org/schemas/sitemap/0.9')
+        rows = db.session.query(Post.id, Post.created_at).filter(
+            Post.id >= partition * SITEMAP_PARTITION,
+            Post.id < (partition + 1) * SITEMAP_PARTITION,
+            Post.author_visible == True,
+        ).order_by(Post.id).all()
+        for post_id, created_at in rows:
+            url = ET.SubElement(urlset, 'url')
+            ET.SubElement(url, 'loc').text = self._url('main.view_post', post_id=post_id)
+            if created_at:
+                ET.SubElement(url, 'lastmod').text = created_at.date().isoformat()
+        return urlset
+
+    def _sitemap_index(self):
+        max_id = db.session.query(func.max(Post.id)).scalar() or 0
+        index = ET.Element('sitemapindex', xmlns='http://www.sitemaps.org/schemas/sitemap/0.9')
+        for partition in range(partition_of(max_id) + 1):
+            # lastmod of a partition is when its file last changed
+            self._ensure(f"sitemap-{partition}")
+            mtime = os.stat(self._path(f"sitemap-{partition}")).st_mtime
+            sitemap = ET.SubElement(index, 'sitemap')
+            ET.SubElement(sitemap, 'loc').text = self._url('main.sitemap_partition', partition=partition)
+            ET.SubElement(sitemap, 'lastmod').text = datetime.fromtimestamp(mtime, timezone.utc).date().isoformat()
+        state = self._read_state()
+        if state.get('max_post_id', 0) < max_id:
+            state['max_post_id'] = max_id
+            self._write_state(state)
+        return index
+
+    def _generate(self, name):
+        if name == 'sitemap':
+            return self._sitemap_index()
+        kind, _, arg = name.partition('-')
+        if kind == 'sitemap':
+            return self._sitemap(int(arg))
+        return self._feed(kind, arg)
+
+    def _write(self, name, root):
+        body = b'<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding='utf-8')
+        data = gzip.compress(body, compresslevel=9, mtime=0)
+        path = self._path(name)
+        try:
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return  # keep the mtime, and with it the ETag
+        except FileNotFoundError:
+            pass
+        _replace(path, data)
+
+    def _ensure(self, name):
+        """Regenerates `name` if it is missing or marked dirty."""
+        marker = self._marker(name)
+        try:
+            marked = os.stat(marker).st_mtime_ns
+        except FileNotFoundError:
+            marked = None
+        if marked is None and os.path.exists(self._path(name)):
+            return
+        self._write(name, self._generate(name))
+        if marked is not None:
+            try:
+                # Marked again while we were generating: leave it for the next request
+                if os.stat(marker).st_mtime_ns == marked:
+                    os.unlink(marker)
+            except FileNotFoundError:
+                pass
+
+    # --------------------
+    # SERVING
+    # --------------------
+
+    def serve(self, name, mimetype):
+        if self.site_url is None:
+            abort(404)
+        self._ensure(name)
+        path = self._path(name)
+        st = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        gzip_ok = 'gzip' in request.headers.get('Accept-Encoding', '')
+        response = Response(data if gzip_ok else gzip.decompress(data), mimetype=mimetype)
+        if gzip_ok:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}'
+        response.set_etag(f"{st.st_mtime_ns:x}-{st.st_size:x}" + ('-gz' if gzip_ok else ''))
+        response.last_modified = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+        return response.make_conditional(request)
+
+
+feed_store = FeedStore()
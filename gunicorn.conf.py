@@ -0,0 +1,45 @@
+# gunicorn -c gunicorn.conf.py
+#
+# With preload_app the app is built once in the master (templates compiled,
+# KVKK text read, profanity matcher and timezone created) and forked
+# workers share that memory copy-on-write.
+import gc
+import os
+import multiprocessing
+
+wsgi_app = 'wsgi:app'
+preload_app = True
+bind = os.environ.get('BIND', '0.0.0.0:' + os.environ.get('PORT', '8000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# gthread workers: a thread waiting on the password hashing pool (hashing.py,
+# at most HASH_MAX_PENDING) or holding a live-update stream (events.py, at
+# most SSE_MAX_STREAMS) leaves the others free to serve pages. Both caps come
+# out of one budget per worker and PAGE_THREADS are always left over.
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+PAGE_THREADS = 2
+
+import hashing  # reads HASH_MAX_PENDING / HASH_POOL_SIZE
+hash_pending = hashing.MAX_PENDING
+# Streams get whatever the page threads and hashing leave
+sse_streams = int(os.environ.get('SSE_MAX_STREAMS', max(0, threads - PAGE_THREADS - hash_pending)))
+if threads - hash_pending - sse_streams < PAGE_THREADS:
+    raise RuntimeError(
+        f"thread budget: GUNICORN_THREADS={threads} leaves fewer than {PAGE_THREADS} threads for pages "
+        f"with HASH_MAX_PENDING={hash_pending} and SSE_MAX_STREAMS={sse_streams}")
+# events.py reads it when the app is loaded
+os.environ['SSE_MAX_STREAMS'] = str(sse_streams)
+
+def when_ready(server):
+    # Keep preloaded objects out of the GC's reach so collections in the
+    # workers don't touch (and copy) the shared pages.
+    gc.freeze()
+
+def post_fork(server, worker):
+    # Connections opened in the master during startup must not be shared
+    from wsgi import app
+    from models import db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    import hashing
+    hashing.start()
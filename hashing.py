@@ -0,0 +1,110 @@
+"""
+Password hashing off the request thread.
+
+scrypt is deliberately CPU-heavy; run inline it holds a gunicorn worker
+(and the GIL) for the whole hash, so a burst of logins stalls every other
+page. Hashes and checks are sent to a small per-worker process pool
+instead, and a semaphore caps how many may be queued: past the cap the
+caller gets HashingBusy at once rather than waiting in line.
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Werkzeug method string; stored hashes with a different prefix are
+# upgraded on the next successful login.
+PASSWORD_METHOD = os.environ.get('PASSWORD_METHOD', 'scrypt:32768:8:1')
+
+# HASH_POOL_SIZE=0 hashes inline on the calling thread (scripts, benchmarks)
+POOL_SIZE = int(os.environ.get('HASH_POOL_SIZE', 1))
+# Waiting logins hold gunicorn threads: gunicorn.conf.py checks this plus
+# SSE_MAX_STREAMS against the threads per worker
+MAX_PENDING = int(os.environ.get('HASH_MAX_PENDING', max(1, POOL_SIZE) * 2))
+HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT', 10))
+# Pool processes run at lower priority so page requests win the CPU
+HASH_NICE = int(os.environ.get('HASH_NICE', 10))
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is at capacity."""
+
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+_pool = None
+_pool_pid = None
+
+
+def _lower_priority():
+    os.nice(HASH_NICE)
+
+
+def _executor():
+    # One pool per process: gunicorn forks workers after the app is loaded,
+    # and a pool inherited from the master would be unusable.
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # fork, not spawn/forkserver: those re-import the __main__ script
+            # in every child.
+            _pool = ProcessPoolExecutor(max_workers=POOL_SIZE,
+                                        mp_context=multiprocessing.get_context('fork'),
+                                        initializer=_lower_priority)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def start():
+    """
+    Forks the pool processes now. Called from gunicorn's post_fork, before
+    the worker starts its threads; forking later from a threaded process
+    can copy a lock some other thread was holding.
+    """
+    if POOL_SIZE > 0:
+        _executor().submit(int).result()
+
+
+def _reset(pool):
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(fn, *args):
+    if POOL_SIZE == 0:
+        return fn(*args)
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+    pool = _executor()
+    try:
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        _slots.release()
+        _reset(pool)
+        raise HashingBusy()
+    # The slot is held until the job really finishes, even if we stop waiting
+    future.add_done_callback(lambda f: _slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeout:
+        raise HashingBusy()
+    except BrokenProcessPool:
+        _reset(pool)
+        raise HashingBusy()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, PASSWORD_METHOD)
+
+
+def verify_password(pwhash, password):
+    return _run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    return not pwhash.startswith(PASSWORD_METHOD + '$')
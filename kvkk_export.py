@@ -0,0 +1,192 @@
+"""
+KVKK personal-data export.
+
+Everything is produced by generators: each table is read in id-ordered
+chunks and written out line by line, so memory stays flat and the first
+byte goes out before the heaviest table is touched.
+
+    python kvkk_export.py <username> [output_file] [--zip]
+"""
+import io
+import os
+import sys
+import json
+import zipfile
+from datetime import datetime, date
+from sqlalchemy import text
+from models import db
+from viewstore import store as view_store
+
+EXPORT_CHUNK = 1000
+FORMAT_VERSION = 1
+
+# (record type, table, owner column, columns). password_hash is never exported.
+EXPORT_TABLES = [
+    ('post', 'post', 'author_id', 'id, title, content, category, created_at, view_count'),
+    ('comment', 'comment', 'author_id', 'id, post_id, parent_id, content, created_at'),
+    ('vote', 'vote', 'user_id', 'id, post_id, value, timestamp'),
+    ('academic_vote', 'academic_features', 'user_id', 'id, post_id, type, value, timestamp'),
+    ('post_view', 'post_view', 'user_id', 'id, post_id, timestamp'),
+    ('report', 'report', 'reporter_id', 'id, reported_user_id, reported_post_id, reason, created_at, is_resolved'),
+]
+
+# agreed_kvkk is null for an imported account that has not accepted the text yet
+PROFILE_COLUMNS = (
+    'id, username, university, position, bio, is_admin, is_verified, verification_type, '
+    'profile_image, is_banned, ban_reason, ban_appeal_reason, ban_expires_at, agreed_kvkk, '
+    'created_at, last_username_change'
+)
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def _line(record_type, data):
+    return json.dumps({'type': record_type, 'data': data}, ensure_ascii=False, default=_default) + '\n'
+
+
+def _chunks(table, owner_column, columns, user_id, chunk=EXPORT_CHUNK):
+    """
+    Keyset-paged reads. Each chunk is its own short read on a pooled
+    connection: on SQLite a cursor held open for a slow download would keep
+    the shared lock and stall every writer.
+    """
+    last = 0
+    while True:
+        with db.engine.connect() as conn:
+            rows = conn.execute(text(
+                f"SELECT {columns} FROM {table} WHERE {owner_column} = :uid AND id > :last "
+                f"ORDER BY id LIMIT :chunk"
+            ), {'uid': user_id, 'last': last, 'chunk': chunk}).mappings().all()
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]['id']
+
+
+def iter_records(user_id):
+    """Yields NDJSON lines (str) for everything stored about user_id."""
+    yield _line('export', {
+        'user_id': user_id,
+        'generated_at': datetime.utcnow(),
+        'format_version': FORMAT_VERSION,
+    })
+
+    with db.engine.connect() as conn:
+        profile = conn.execute(text(f"SELECT {PROFILE_COLUMNS} FROM user WHERE id = :uid"),
+                               {'uid': user_id}).mappings().first()
+    if profile is None:
+        return
+    yield _line('user', dict(profile))
+
+    for record_type, table, owner_column, columns in EXPORT_TABLES:
+        for rows in _chunks(table, owner_column, columns, user_id):
+            for row in rows:
+                yield _line(record_type, dict(row))
+
+    # Unique views live in per-post bitmaps
+    for post_id in view_store.viewed_post_ids(user_id):
+        yield _line('viewed_post', {'post_id': post_id})
+
+
+def uploaded_files(user_id, upload_dir, since=None):
+    """
+    Paths of images the user uploaded (named '<user_id>_<unix ts>_<name>').
+    Files older than `since` are skipped: SQLite can hand a deleted user's
+    id to a new account, and the old uploads are not theirs.
+    """
+    prefix = f"{user_id}_"
+    if not os.path.isdir(upload_dir):
+        return
+    with os.scandir(upload_dir) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.startswith(prefix):
+                continue
+            if since is not None:
+                stamp = entry.name[len(prefix):].split('_', 1)[0]
+                if not stamp.isdigit() or int(stamp) < int(since.timestamp()):
+                    continue
+            yield entry.path
+
+
+def iter_ndjson(user_id):
+    for line in iter_records(user_id):
+        yield line.encode('utf-8')
+
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable sink, zipfile falls back to data descriptors for it."""
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def iter_zip(user_id, upload_dir, since=None, flush_bytes=64 * 1024):
+    """Yields a zip archive (data.ndjson + uploads/) in pieces."""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open('data.ndjson', 'w', force_zip64=True) as member:
+            pending = 0
+            for line in iter_records(user_id):
+                data = line.encode('utf-8')
+                member.write(data)
+                pending += len(data)
+                if pending >= flush_bytes:
+                    pending = 0
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+
+        for path in uploaded_files(user_id, upload_dir, since):
+            with open(path, 'rb') as src, zf.open('uploads/' + os.path.basename(path), 'w') as member:
+                while True:
+                    block = src.read(flush_bytes)
+                    if not block:
+                        break
+                    member.write(block)
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+    yield sink.drain()
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from models import User
+    app = create_app({'WARM_STARTUP': False})
+
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if not args:
+        print("Kullanim: python kvkk_export.py <kullanici_adi> [cikti_dosyasi] [--zip]")
+        sys.exit(1)
+    as_zip = '--zip' in sys.argv
+    out_path = args[1] if len(args) > 1 else f"{args[0]}_kvkk.{'zip' if as_zip else 'ndjson'}"
+
+    with app.app_context():
+        user = User.query.filter_by(username=args[0]).first()
+        if not user:
+            print("Kullanici bulunamadi.")
+            sys.exit(1)
+        upload_dir = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+        pieces = iter_zip(user.id, upload_dir, user.created_at) if as_zip else iter_ndjson(user.id)
+        with open(out_path, 'wb') as f:
+            for piece in pieces:
+                f.write(piece)
+        print(f"Veriler {out_path} dosyasina yazildi.")
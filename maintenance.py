@@ -0,0 +1,410 @@
+"""
+Data retention, expired bans and SQLite upkeep.
+
+    python maintenance.py                  # run the jobs that are due
+    python maintenance.py --force          # run every job now
+    python maintenance.py --job retention  # one job (bans, retention, vacuum, analyze)
+    python maintenance.py --dry-run        # only count what retention would delete
+    python maintenance.py --enable-incremental-vacuum
+
+Meant for cron, e.g. every five minutes:
+`*/5 * * * * cd /srv/forum && python maintenance.py`.
+When each job last ran is kept in instance/maintenance.json, so running it
+more often than the intervals below is harmless.
+
+Deletes go in batches of RETENTION_BATCH rows, one short transaction each,
+with a pause in between so request handlers waiting on the write lock get
+their turn.
+"""
+import os
+import sys
+import json
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam
+
+# Retention (days), overridable from the environment
+REPORT_RETENTION_DAYS = int(os.environ.get('REPORT_RETENTION_DAYS', 90))
+POST_VIEW_RETENTION_DAYS = int(os.environ.get('POST_VIEW_RETENTION_DAYS', 180))
+
+RETENTION_BATCH = 500
+BATCH_PAUSE = 0.05
+VACUUM_STEP_PAGES = 256
+
+# Seconds between scheduled runs
+SCHEDULE = {
+    'bans': 5 * 60,
+    'retention': 24 * 3600,
+    'vacuum': 7 * 24 * 3600,
+    'analyze': 24 * 3600,
+}
+
+ORPHAN_REPLIES = "parent_id IS NOT NULL AND parent_id NOT IN (SELECT id FROM comment)"
+
+# Rows left behind by raw-SQL migrations and deletes that bypassed the ORM
+# cascades (SQLite does not enforce the foreign keys here).
+ORPHAN_RULES = [
+    ('comment', "post_id NOT IN (SELECT id FROM post)"),
+    ('comment', ORPHAN_REPLIES),
+    ('comment', "author_id NOT IN (SELECT id FROM user)"),
+    ('vote', "post_id NOT IN (SELECT id FROM post) OR user_id NOT IN (SELECT id FROM user)"),
+    ('academic_features', "post_id NOT IN (SELECT id FROM post) OR user_id NOT IN (SELECT id FROM user)"),
+    ('post_view', "post_id NOT IN (SELECT id FROM post) OR user_id NOT IN (SELECT id FROM user)"),
+    ('post_viewers', "post_id NOT IN (SELECT id FROM post)"),
+    ('post_signature', "post_id NOT IN (SELECT id FROM post)"),
+    ('report', "reporter_id NOT IN (SELECT id FROM user)"
+               " OR (reported_post_id IS NOT NULL AND reported_post_id NOT IN (SELECT id FROM post))"
+               " OR (reported_user_id IS NOT NULL AND reported_user_id NOT IN (SELECT id FROM user))"),
+]
+
+# Queries whose plans are compared before and after ANALYZE
+PLAN_PROBES = {
+    'feed': "SELECT id FROM post WHERE author_visible = 1 ORDER BY created_at DESC LIMIT 10",
+    'category feed': "SELECT id FROM post WHERE author_visible = 1 AND category = 'QUESTION' "
+                     "ORDER BY created_at DESC LIMIT 10",
+    'comment thread': "SELECT id FROM comment WHERE post_id = 1 AND parent_id IS NULL AND author_visible = 1 "
+                      "ORDER BY created_at DESC LIMIT 21",
+    'user posts': "SELECT id FROM post WHERE author_id = 1",
+    'open reports': "SELECT id FROM report WHERE is_resolved = 0",
+}
+
+
+def _sql_time(dt):
+    # Same text format SQLAlchemy stores DateTime in on SQLite
+    return dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _tables(conn):
+    return {r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+
+
+# --------------------
+# RETENTION
+# --------------------
+
+def retention_rules(conn):
+    """(label, table, WHERE clause, params) for the plain retention deletes (see also delete_old_post_views)."""
+    now = datetime.utcnow()
+    rules = [(
+        'resolved reports', 'report',
+        "is_resolved = 1 AND created_at < :cutoff",
+        {'cutoff': _sql_time(now - timedelta(days=REPORT_RETENTION_DAYS))},
+    )]
+
+    tables = _tables(conn)
+    for table, where in ORPHAN_RULES:
+        if table in tables:
+            rules.append((f"orphaned {table}", table, where, {}))
+    return rules
+
+
+def delete_in_batches(engine, table, where, params, batch=RETENTION_BATCH):
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            n = conn.execute(text(
+                f"DELETE FROM {table} WHERE rowid IN "
+                f"(SELECT rowid FROM {table} WHERE {where} LIMIT :batch)"
+            ), dict(params, batch=batch)).rowcount
+        deleted += n
+        if n < batch:
+            return deleted
+        time.sleep(BATCH_PAUSE)
+
+
+def delete_old_post_views(engine, dry_run=False, batch=RETENTION_BATCH):
+    """
+    Legacy view rows can go once they are in the hourly rollups
+    (analytics.run_rollup) and the viewer is in the post's bitmap
+    (viewstore). The bitmap is a blob, so membership is checked here, one
+    batch of candidates at a time, rather than in the WHERE clause: a
+    post_viewers row alone says nothing about whether migrate_post_views.py
+    got to this user. Returns the number of rows deleted (or deletable).
+    """
+    from viewstore import ViewerBitmap
+
+    with engine.connect() as conn:
+        if not {'post_view', 'post_viewers', 'rollup_watermark'} <= _tables(conn):
+            return 0
+        mark = conn.execute(text("SELECT last_id FROM rollup_watermark WHERE source = 'post_view'")).scalar() or 0
+    cutoff = _sql_time(datetime.utcnow() - timedelta(days=POST_VIEW_RETENTION_DAYS))
+
+    deleted, last = 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, post_id, user_id FROM post_view "
+                "WHERE id > :last AND id <= :rolled_up AND timestamp < :cutoff ORDER BY id LIMIT :batch"
+            ), {'last': last, 'rolled_up': mark, 'cutoff': cutoff, 'batch': batch}).all()
+            if not rows:
+                return deleted
+            bitmaps = {
+                post_id: ViewerBitmap.from_bytes(blob) for post_id, blob in conn.execute(
+                    text("SELECT post_id, bitmap FROM post_viewers WHERE post_id IN :ids")
+                    .bindparams(bindparam('ids', expanding=True)),
+                    {'ids': list({r.post_id for r in rows})})
+            }
+            ids = [r.id for r in rows if r.post_id in bitmaps and r.user_id in bitmaps[r.post_id]]
+            if ids and not dry_run:
+                conn.execute(text("DELETE FROM post_view WHERE id IN :ids")
+                             .bindparams(bindparam('ids', expanding=True)), {'ids': ids})
+        deleted += len(ids)
+        last = rows[-1].id
+        if len(rows) < batch:
+            return deleted
+        time.sleep(BATCH_PAUSE)
+
+
+def run_retention(engine, dry_run=False):
+    with engine.connect() as conn:
+        rules = retention_rules(conn)
+    report = {'old post views': delete_old_post_views(engine, dry_run=dry_run)}
+    for label, table, where, params in rules:
+        if dry_run:
+            with engine.connect() as conn:
+                n = conn.execute(text(f"SELECT COUNT(*) FROM {table} WHERE {where}"), params).scalar()
+        else:
+            n = delete_in_batches(engine, table, where, params)
+        report[label] = report.get(label, 0) + n
+    # Replies of a deleted orphan are orphans themselves
+    while not dry_run:
+        more = delete_in_batches(engine, 'comment', ORPHAN_REPLIES, {})
+        if not more:
+            break
+        report['orphaned comment'] = report.get('orphaned comment', 0) + more
+    return report
+
+
+# --------------------
+# BANS
+# --------------------
+
+def run_ban_sweep():
+    """
+    Lifts bans that ran out while the user was away, so their posts show
+    again without them logging in. Returns the user ids.
+    """
+    from models import User
+    from feeds import feed_store
+
+    lifted = User.lift_expired_bans()
+    for user_id in lifted:
+        feed_store.mark_author(user_id)
+    return lifted
+
+
+# --------------------
+# VACUUM
+# --------------------
+
+def space(conn):
+    page_size = conn.execute(text("PRAGMA page_size")).scalar()
+    return {
+        'pages': conn.execute(text("PRAGMA page_count")).scalar(),
+        'free_pages': conn.execute(text("PRAGMA freelist_count")).scalar(),
+        'page_size': page_size,
+    }
+
+
+def enable_incremental_vacuum(engine):
+    # auto_vacuum only takes effect after one full VACUUM, which rewrites
+    # the whole file under an exclusive lock: run it in a quiet moment.
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+        return conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2
+
+
+def run_vacuum(engine):
+    """Returns the pages freed; None when incremental vacuum is not enabled."""
+    with engine.connect() as conn:
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+            return None
+    # sqlite3's execute() steps a statement once, and incremental_vacuum
+    # frees one page per step; executescript() runs it to completion.
+    raw = engine.raw_connection()
+    try:
+        sqlite = raw.driver_connection
+        freed = 0
+        while True:
+            before = sqlite.execute("PRAGMA freelist_count").fetchone()[0]
+            if not before:
+                return freed
+            sqlite.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});")
+            freed += before - sqlite.execute("PRAGMA freelist_count").fetchone()[0]
+            time.sleep(BATCH_PAUSE)
+    finally:
+        raw.close()
+
+
+# --------------------
+# ANALYZE
+# --------------------
+
+def _stats(conn):
+    if 'sqlite_stat1' not in _tables(conn):
+        return {}
+    return {(tbl, idx): stat for tbl, idx, stat in conn.execute(text("SELECT tbl, idx, stat FROM sqlite_stat1"))}
+
+
+def _plans(conn):
+    tables = _tables(conn)
+    plans = {}
+    for name, sql in PLAN_PROBES.items():
+        table = sql.split(' FROM ', 1)[1].split()[0]
+        if table in tables:
+            plans[name] = ' | '.join(r[3] for r in conn.execute(text("EXPLAIN QUERY PLAN " + sql)))
+    return plans
+
+
+def run_analyze(engine, full=False):
+    """
+    PRAGMA optimize (ANALYZE only where SQLite thinks the statistics are
+    stale); a full ANALYZE the first time or with full=True. Returns the
+    sqlite_stat1 rows and probe query plans that changed.
+    """
+    with engine.connect() as conn:
+        stats, plans = _stats(conn), _plans(conn)
+    with engine.begin() as conn:
+        if full or not stats:
+            conn.exec_driver_sql("ANALYZE")
+        else:
+            conn.exec_driver_sql("PRAGMA optimize")
+    with engine.connect() as conn:
+        new_stats, new_plans = _stats(conn), _plans(conn)
+    return {
+        'stats': {f"{tbl}.{idx}" if idx else tbl: (stats.get((tbl, idx)), new_stats.get((tbl, idx)))
+                  for tbl, idx in sorted(stats.keys() | new_stats.keys(), key=str)
+                  if stats.get((tbl, idx)) != new_stats.get((tbl, idx))},
+        'plans': {name: (plans.get(name), new_plans.get(name))
+                  for name in new_plans if plans.get(name) != new_plans[name]},
+    }
+
+
+# --------------------
+# SCHEDULING
+# --------------------
+
+def _state_path(app):
+    return os.path.join(app.instance_path, 'maintenance.json')
+
+
+def load_state(app):
+    try:
+        with open(_state_path(app)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(app, state):
+    tmp = _state_path(app) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp, _state_path(app))
+
+
+def due_jobs(state, now=None):
+    now = now or time.time()
+    return [job for job, every in SCHEDULE.items()
+            if now - state.get(job, {}).get('last_run', 0) >= every]
+
+
+def restore_import_indexes(engine):
+    """Recreates indexes a crashed `bulk_import.py --drop-indexes` left dropped."""
+    with engine.connect() as conn:
+        if 'bulk_import_index' not in _tables(conn):
+            return 0
+    from bulk_import import restore_indexes
+
+    raw = engine.raw_connection()
+    sqlite = raw.driver_connection
+    isolation = sqlite.isolation_level
+    sqlite.isolation_level = None
+    try:
+        return restore_indexes(sqlite)
+    finally:
+        sqlite.isolation_level = isolation
+        raw.close()
+
+
+def run(app, jobs, dry_run=False, full_analyze=False):
+    from models import db
+
+    state = load_state(app)
+    with app.app_context():
+        engine = db.engine
+        if not dry_run:
+            restored = restore_import_indexes(engine)
+            if restored:
+                print(f"{restored} indexes dropped by an interrupted bulk import recreated")
+        with engine.connect() as conn:
+            before = space(conn)
+        file_before = os.path.getsize(engine.url.database) if engine.url.database else None
+
+        for job in jobs:
+            started = time.time()
+            if job == 'bans':
+                result = run_ban_sweep()
+                print(f"  {len(result)} expired bans lifted")
+            elif job == 'retention':
+                result = run_retention(engine, dry_run=dry_run)
+                for label, n in result.items():
+                    print(f"  {label}: {n} {'to delete' if dry_run else 'deleted'}")
+            elif job == 'vacuum':
+                result = run_vacuum(engine)
+                if result is None:
+                    print("  incremental vacuum is off (auto_vacuum=NONE); "
+                          "run with --enable-incremental-vacuum once")
+                else:
+                    print(f"  {result} free pages returned to the filesystem")
+            elif job == 'analyze':
+                result = run_analyze(engine, full=full_analyze)
+                for key, (old, new) in result['stats'].items():
+                    print(f"  stat {key}: {old} -> {new}")
+                for name, (old, new) in result['plans'].items():
+                    print(f"  plan '{name}' changed:\n    before: {old}\n    after:  {new}")
+                if not result['stats'] and not result['plans']:
+                    print("  statistics unchanged")
+            else:
+                raise ValueError(f"unknown job: {job}")
+            print(f"{job}: done in {time.time() - started:.2f}s")
+            if not dry_run:
+                state[job] = {'last_run': started, 'result': result}
+
+        with engine.connect() as conn:
+            after = space(conn)
+        file_after = os.path.getsize(engine.url.database) if engine.url.database else None
+
+    print(f"pages {before['pages']} -> {after['pages']}, "
+          f"free pages {before['free_pages']} -> {after['free_pages']}")
+    if file_before is not None:
+        print(f"file size {file_before} -> {file_after} bytes "
+              f"({file_before - file_after} reclaimed)")
+    if not dry_run:
+        save_state(app, state)
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from models import db
+    app = create_app({'WARM_STARTUP': False})
+
+    args = sys.argv[1:]
+    if '--enable-incremental-vacuum' in args:
+        with app.app_context():
+            ok = enable_incremental_vacuum(db.engine)
+        print("auto_vacuum = INCREMENTAL" if ok else "could not enable incremental vacuum")
+        sys.exit(0 if ok else 1)
+
+    if '--job' in args:
+        jobs = [args[args.index('--job') + 1]]
+    elif '--force' in args or '--dry-run' in args:
+        jobs = list(SCHEDULE)
+    else:
+        jobs = due_jobs(load_state(app))
+    if '--dry-run' in args:
+        jobs = [job for job in jobs if job == 'retention']
+    if not jobs:
+        print("Nothing due.")
+    run(app, jobs, dry_run='--dry-run' in args, full_analyze='--full' in args)
@@ -1,7 +1,9 @@
-from app import app, db
+from app import create_app, db
 from models import User
 from sqlalchemy import text
 
+app = create_app({'WARM_STARTUP': False})
+
 # Manually add the column to existing database
 with app.app_context():
     try:
@@ -0,0 +1,48 @@
+import re
+import sqlite3
+
+# Makes user.agreed_kvkk nullable. Accounts brought over by bulk_import.py
+# never accepted this platform's KVKK text, so they are stored with NULL and
+# asked for consent on their next login (see require_kvkk_consent in app.py).
+#
+# SQLite cannot drop a NOT NULL constraint in place: the table is rebuilt
+# from its own CREATE statement with only that column changed, then renamed
+# into place. Foreign keys are not enforced here, so the tables that
+# reference user are unaffected.
+
+def migrate_kvkk_consent():
+    conn = sqlite3.connect('instance/forum.db')
+    conn.isolation_level = None
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'user'")
+    sql = cursor.fetchone()[0]
+    if not re.search(r"agreed_kvkk DATETIME NOT NULL", sql):
+        print("agreed_kvkk is already nullable.")
+        conn.close()
+        return
+
+    new_sql = sql.replace("agreed_kvkk DATETIME NOT NULL", "agreed_kvkk DATETIME", 1)
+    new_sql = re.sub(r"^CREATE TABLE \"?user\"? \(", "CREATE TABLE user_new (", new_sql)
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'user' AND sql IS NOT NULL")
+    indexes = [r[0] for r in cursor.fetchall()]
+    cursor.execute("PRAGMA table_info(user)")
+    columns = ', '.join(f'"{r[1]}"' for r in cursor.fetchall())
+
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(new_sql)
+        cursor.execute(f"INSERT INTO user_new ({columns}) SELECT {columns} FROM user")
+        cursor.execute("DROP TABLE user")
+        cursor.execute("ALTER TABLE user_new RENAME TO user")
+        for index in indexes:
+            cursor.execute(index)
+        cursor.execute("COMMIT")
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        raise
+    print("agreed_kvkk is now nullable (NULL: consent asked at next login).")
+    conn.close()
+
+if __name__ == '__main__':
+    migrate_kvkk_consent()
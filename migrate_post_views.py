@@ -0,0 +1,66 @@
+import sys
+from app import create_app, db
+from sqlalchemy import text
+from viewstore import ViewerBitmap, HyperLogLog
+import analytics
+
+# Run after migrate_universities.py and add_vote_timestamp.py: the legacy
+# rows are folded into the rollups first, which read user.university_id
+# and vote.timestamp.
+
+app = create_app({'WARM_STARTUP': False})
+
+BATCH_POSTS = 500
+
+def flush(conn, pending):
+    for post_id, user_ids in pending.items():
+        row = conn.execute(text("SELECT bitmap, sketch FROM post_viewers WHERE post_id = :pid"),
+                           {'pid': post_id}).first()
+        bitmap = ViewerBitmap.from_bytes(row.bitmap) if row else ViewerBitmap()
+        sketch = HyperLogLog.from_bytes(row.sketch) if row else HyperLogLog()
+        for uid in user_ids:
+            bitmap.add(uid)
+            sketch.add(uid)
+        conn.execute(text(
+            "INSERT INTO post_viewers (post_id, bitmap, sketch, viewer_count, version, updated_at) "
+            "VALUES (:pid, :bitmap, :sketch, :count, 1, CURRENT_TIMESTAMP) "
+            "ON CONFLICT(post_id) DO UPDATE SET bitmap = excluded.bitmap, sketch = excluded.sketch, "
+            "viewer_count = excluded.viewer_count, version = version + 1"
+        ), {'pid': post_id, 'bitmap': bitmap.to_bytes(), 'sketch': sketch.to_bytes(), 'count': len(bitmap)})
+
+def migrate_post_views(drop=False):
+    with app.app_context():
+        db.create_all()
+        missing = analytics.missing_migrations()
+        if missing:
+            raise SystemExit(f"Run {', '.join(missing)} before migrate_post_views.py.")
+        # Fold legacy rows into the hourly rollups before they can go away
+        analytics.run_rollup()
+
+        converted = 0
+        last = 0
+        while True:
+            # One short transaction per batch of posts
+            with db.engine.begin() as conn:
+                post_ids = [r[0] for r in conn.execute(text(
+                    "SELECT DISTINCT post_id FROM post_view WHERE post_id > :last "
+                    "ORDER BY post_id LIMIT :n"), {'last': last, 'n': BATCH_POSTS})]
+                if not post_ids:
+                    break
+                pending = {}
+                for post_id, user_id in conn.execute(text(
+                        "SELECT post_id, user_id FROM post_view WHERE post_id BETWEEN :lo AND :hi"),
+                        {'lo': post_ids[0], 'hi': post_ids[-1]}):
+                    pending.setdefault(post_id, []).append(user_id)
+                    converted += 1
+                flush(conn, pending)
+                last = post_ids[-1]
+        print(f"{converted} post_view rows converted into viewer bitmaps.")
+
+        if drop:
+            with db.engine.begin() as conn:
+                conn.execute(text("DELETE FROM post_view"))
+            print("Legacy post_view rows deleted.")
+
+if __name__ == '__main__':
+    migrate_post_views(drop='--drop' in sys.argv)
@@ -0,0 +1,106 @@
+import sys
+import sqlite3
+from sqlalchemy import func, text
+
+# Moves free-text user.university values onto the university table.
+#
+#     python migrate_universities.py [--dry-run]
+#
+# Values naming the same university ("ODTÜ", "odtu", "Orta Doğu Teknik
+# Üniversitesi") are clustered by universities.cluster(). user.university
+# keeps the text as typed; user.university_id points at the cluster.
+# Rollup rows (post_stats_hourly, realism_histogram_hourly) get the same
+# university_id, resolved from the text they were rolled up with.
+
+ROLLUP_TABLES = ('post_stats_hourly', 'realism_histogram_hourly')
+
+def add_university_column():
+    # Raw sqlite3: the app cannot be imported while the User model has a
+    # column the table lacks.
+    conn = sqlite3.connect('instance/forum.db')
+    cursor = conn.cursor()
+
+    cursor.execute("PRAGMA table_info(user)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'university_id' not in columns:
+        print("Adding university_id column to user table...")
+        cursor.execute("ALTER TABLE user ADD COLUMN university_id INTEGER REFERENCES university(id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_user_university_id ON user (university_id)")
+        print("Column added successfully.")
+    else:
+        print("Column already exists.")
+
+    # Rollup tables created before university_id was added to them
+    for table in ROLLUP_TABLES:
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in cursor.fetchall()]
+        if columns and 'university_id' not in columns:
+            print(f"Adding university_id column to {table}...")
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN university_id INTEGER REFERENCES university(id)")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_university_id ON {table} (university_id)")
+
+    conn.commit()
+    conn.close()
+
+def backfill_rollups():
+    """
+    Points existing rollup rows at their university. Rows keep the author's
+    text as it was at the time, so they are resolved from that text rather
+    than from the (possibly deleted or edited) user.
+    """
+    from models import db
+    import universities
+
+    for table in ROLLUP_TABLES:
+        values = [r[0] for r in db.session.execute(text(
+            f"SELECT DISTINCT university FROM {table} WHERE university_id IS NULL AND university IS NOT NULL"))]
+        linked = 0
+        for value in values:
+            uni = universities.resolve(value, create=False)
+            if uni is not None:
+                linked += db.session.execute(text(
+                    f"UPDATE {table} SET university_id = :uid WHERE university_id IS NULL AND university = :value"
+                ), {'uid': uni.id, 'value': value}).rowcount
+        print(f"{table}: {linked} satir universitelere baglandi.")
+
+def migrate(dry_run=False):
+    add_university_column()
+
+    from app import create_app
+    from models import db, User, University
+    import universities
+
+    app = create_app({'WARM_STARTUP': False})
+
+    with app.app_context():
+        db.create_all()
+        counts = dict(
+            db.session.query(User.university, func.count(User.id))
+            .filter(User.university.isnot(None))
+            .group_by(User.university)
+            .all()
+        )
+        groups = universities.cluster(counts)
+
+        for name, slug, members in groups:
+            print(f"{name} [{slug}]: {', '.join(members)}")
+        print(f"{len(counts)} farkli deger -> {len(groups)} universite.")
+        if dry_run:
+            return
+
+        for name, slug, members in groups:
+            uni = University.query.filter_by(slug=slug).first()
+            if uni is None:
+                uni = University(name=name, slug=slug, acronym=universities.acronym(name))
+                db.session.add(uni)
+                db.session.flush()
+            User.query.filter(User.university.in_(members)) \
+                .update({User.university_id: uni.id}, synchronize_session=False)
+        db.session.commit()
+        print("Kullanicilar universitelere baglandi.")
+
+        backfill_rollups()
+        db.session.commit()
+
+if __name__ == '__main__':
+    migrate(dry_run='--dry-run' in sys.argv)
@@ -1,5 +1,5 @@
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+import hashing
 from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
 from enum import Enum
@@ -21,17 +21,60 @@ class PostCategory(Enum):
 # POST VIEW (analytics)
 # --------------------
 
+# Legacy one-row-per-(post, user) table. New views go to PostViewers
+# (see viewstore.py and migrate_post_views.py); kept for old rows.
 class PostView(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
     __table_args__ = (
         db.UniqueConstraint('post_id', 'user_id', name='unique_post_view'),
+        # Rollup watermark is on id (analytics.py): never reuse a deleted one
+        {'sqlite_autoincrement': True},
     )
 
 
+class PostViewers(db.Model):
+    """
+    Unique viewers of a post as a compressed bitmap of user ids, plus an
+    optional HyperLogLog sketch. version is bumped on every write for
+    optimistic locking between workers.
+    """
+    __tablename__ = 'post_viewers'
+
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    bitmap = db.Column(db.LargeBinary, nullable=False)
+    sketch = db.Column(db.LargeBinary)
+    viewer_count = db.Column(db.Integer, default=0, nullable=False)
+    version = db.Column(db.Integer, default=1, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# --------------------
+# POST SIGNATURE (near-duplicate detection)
+# --------------------
+
+class PostSignature(db.Model):
+    """
+    MinHash signature of a post's title + content (see dedupe.py).
+    duplicate_of_id / similarity are set when the post was flagged as a
+    near-duplicate at submission; duplicate_of_id is not a foreign key so
+    the flag survives the original being deleted.
+    """
+    __tablename__ = 'post_signature'
+    # Ids follow commit order and are never reused; dedupe.py pages on them
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, unique=True)
+    signature = db.Column(db.LargeBinary, nullable=False)
+    duplicate_of_id = db.Column(db.Integer, index=True)
+    similarity = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
 # --------------------
 # ACADEMIC FEATURES
 # --------------------
@@ -45,16 +88,36 @@ class AcademicFeatures(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     type = db.Column(db.String(20), nullable=False)
     value = db.Column(db.Integer, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
     __table_args__ = (
         db.UniqueConstraint('post_id', 'user_id', 'type', name='unique_academic_vote'),
+        # Rollup watermark is on id (analytics.py): never reuse a deleted one
+        {'sqlite_autoincrement': True},
     )
 
 
+# --------------------
+# UNIVERSITY
+# --------------------
+
+class University(db.Model):
+    """
+    Normalized university (see universities.py). slug is the folded name
+    without "üniversitesi"; acronym is e.g. 'odtu'.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    slug = db.Column(db.String(120), unique=True, nullable=False)
+    acronym = db.Column(db.String(20), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    users = db.relationship('User', backref='university_ref', lazy=True)
+
+
 # --------------------
 # USER
 # --------------------
@@ -64,7 +127,8 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
 
-    university = db.Column(db.String(120))
+    university = db.Column(db.String(120))  # as typed, may include the department
+    university_id = db.Column(db.Integer, db.ForeignKey('university.id'), index=True)
     position = db.Column(db.String(120))  # Student, Professor, Alumni
     bio = db.Column(db.String(500))
 
@@ -83,7 +147,8 @@ class User(UserMixin, db.Model):
     ban_appeal_reason = db.Column(db.Text)  # Appeal text
     ban_expires_at = db.Column(db.DateTime)
 
-    agreed_kvkk = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # NULL for imported accounts until they accept the text here (migrate_kvkk_consent.py)
+    agreed_kvkk = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     last_username_change = db.Column(db.DateTime) # Track last username change
@@ -112,11 +177,40 @@ class User(UserMixin, db.Model):
         delta = (self.last_username_change + timedelta(days=7)) - datetime.utcnow()
         return delta.days + 1
 
+    def ban(self, reason, expires_at=None):
+        self.is_banned = True
+        self.ban_reason = reason
+        self.ban_expires_at = expires_at
+        self.set_content_visible(False)
+
+    def lift_ban(self):
+        self.is_banned = False
+        self.ban_reason = None
+        self.ban_expires_at = None
+        self.set_content_visible(True)
+
+    def set_content_visible(self, visible):
+        # Bulk UPDATEs of the denormalized flag, committed with the ban change
+        Post.query.filter_by(author_id=self.id).update({Post.author_visible: visible}, synchronize_session=False)
+        Comment.query.filter_by(author_id=self.id).update({Comment.author_visible: visible}, synchronize_session=False)
+
+    @classmethod
+    def lift_expired_bans(cls):
+        """Unbans everyone whose ban has run out. Returns their ids."""
+        expired = cls.query.filter(cls.is_banned == True, cls.ban_expires_at.isnot(None),
+                                   cls.ban_expires_at < datetime.utcnow()).all()
+        for user in expired:
+            user.lift_ban()
+        if expired:
+            db.session.commit()
+        return [user.id for user in expired]
+
+    # Both run on the hashing pool and may raise hashing.HashingBusy
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hashing.hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hashing.verify_password(self.password_hash, password)
 
 
 # --------------------
@@ -128,7 +222,7 @@ class Post(db.Model):
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
 
-    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     category = db.Column(db.Enum(PostCategory), nullable=False)
@@ -136,6 +230,16 @@ class Post(db.Model):
     # Cached counters
     view_count = db.Column(db.Integer, default=0)
 
+    # False while the author is banned (User.ban / User.lift_ban)
+    author_visible = db.Column(db.Boolean, default=True, nullable=False)
+
+    # Partial: only rows the feed can show
+    __table_args__ = (
+        db.Index('ix_post_visible_created', 'created_at', sqlite_where=db.text('author_visible = 1')),
+        db.Index('ix_post_visible_category_created', 'category', 'created_at',
+                 sqlite_where=db.text('author_visible = 1')),
+    )
+
     comments = db.relationship(
         'Comment',
         backref='post',
@@ -164,6 +268,20 @@ class Post(db.Model):
         cascade="all, delete-orphan"
     )
 
+    viewers = db.relationship(
+        'PostViewers',
+        uselist=False,
+        lazy=True,
+        cascade="all, delete-orphan"
+    )
+
+    signature = db.relationship(
+        'PostSignature',
+        uselist=False,
+        lazy=True,
+        cascade="all, delete-orphan"
+    )
+
     @property
     def score(self):
         return sum(v.value for v in self.votes)
@@ -213,15 +331,22 @@ class Comment(db.Model):
     content = db.Column(db.Text, nullable=False)
 
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
-    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
 
     created_at = db.Column(db.DateTime, default=datetime.now) # Changed to datetime.now for local time awareness potential but usually handled by tz
     is_hidden = db.Column(db.Boolean, default=False)
+    author_visible = db.Column(db.Boolean, default=True, nullable=False)  # see Post.author_visible
     
     # Self-referential relationship for nesting
     parent_id = db.Column(db.Integer, db.ForeignKey('comment.id'), nullable=True)
     replies = db.relationship('Comment', backref=db.backref('parent', remote_side=[id]), lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Thread windows (comment_window.py) are range scans of this index
+        db.Index('ix_comment_visible_thread', 'post_id', 'parent_id', 'created_at',
+                 sqlite_where=db.text('author_visible = 1')),
+    )
+
 
 # --------------------
 # VOTE
@@ -234,9 +359,12 @@ class Vote(db.Model):
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
 
     value = db.Column(db.Integer, nullable=False)  # 1 or -1
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
     __table_args__ = (
         db.UniqueConstraint('user_id', 'post_id', name='unique_user_post_vote'),
+        # Rollup watermark is on id (analytics.py): never reuse a deleted one
+        {'sqlite_autoincrement': True},
     )
 
 
@@ -246,7 +374,7 @@ class Vote(db.Model):
 
 class Report(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    reporter_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    reporter_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     
     # Can report a user OR a post
     reported_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
@@ -259,3 +387,63 @@ class Report(db.Model):
     reporter = db.relationship('User', foreign_keys=[reporter_id], backref=db.backref('reports_made', cascade="all, delete-orphan"))
     reported_user = db.relationship('User', foreign_keys=[reported_user_id], backref=db.backref('reports_received', cascade="all, delete-orphan"))
     reported_post = db.relationship('Post', backref=db.backref('reports', cascade="all, delete-orphan"))
+
+
+# --------------------
+# ANALYTICS ROLLUPS
+# --------------------
+
+class PostStatsHourly(db.Model):
+    """
+    Per post, per hour counters filled by analytics.run_rollup().
+    category and university (author's) are copied from the post so the
+    dashboard can group without touching the raw tables.
+    Vote/academic counters are events as cast; later edits are not replayed.
+    """
+    __tablename__ = 'post_stats_hourly'
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False)  # hour start, UTC
+    post_id = db.Column(db.Integer, nullable=False)  # no FK, history outlives the post
+    category = db.Column(db.String(20))
+    university = db.Column(db.String(120))  # as typed, may include the department
+    university_id = db.Column(db.Integer, db.ForeignKey('university.id'), index=True)  # what totals_by groups on
+
+    views = db.Column(db.Integer, default=0, nullable=False)
+    upvotes = db.Column(db.Integer, default=0, nullable=False)
+    downvotes = db.Column(db.Integer, default=0, nullable=False)
+    experience_marks = db.Column(db.Integer, default=0, nullable=False)
+    wish_knew_marks = db.Column(db.Integer, default=0, nullable=False)
+    realism_votes = db.Column(db.Integer, default=0, nullable=False)
+    realism_total = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('bucket', 'post_id', name='unique_post_stats_bucket'),
+        db.Index('ix_post_stats_post_bucket', 'post_id', 'bucket'),
+    )
+
+
+class RealismHistogramHourly(db.Model):
+    __tablename__ = 'realism_histogram_hourly'
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False)
+    post_id = db.Column(db.Integer, nullable=False)
+    category = db.Column(db.String(20))
+    university = db.Column(db.String(120))  # as typed, may include the department
+    university_id = db.Column(db.Integer, db.ForeignKey('university.id'), index=True)
+    score = db.Column(db.Integer, nullable=False)  # 1-10
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('bucket', 'post_id', 'score', name='unique_realism_bucket_score'),
+    )
+
+
+class RollupWatermark(db.Model):
+    """Highest raw row id already folded into the rollups, per source table."""
+    __tablename__ = 'rollup_watermark'
+
+    source = db.Column(db.String(40), primary_key=True)
+    last_id = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,431 @@
+"""
+"Related posts" from TF-IDF cosine similarity.
+
+The index lives on disk under instance/related_index:
+
+    CURRENT           generation number of the live index
+    gen-<n>/          base segment, NumPy arrays opened with mmap_mode='r'
+                      (inverted CSR term -> docs, forward CSR doc -> terms)
+    delta-<n>.jsonl   posts added/removed since gen-<n> was built
+
+Workers share the base pages through the page cache and replay the delta
+log (appended with O_APPEND, so every worker sees every change). Once the
+delta grows past REBUILD_DELTA a background thread folds it into a new
+generation. Appends hold .delta.lock shared and the build holds it
+exclusively while it carries the old delta over and switches CURRENT, so
+no change lands in a delta that has already been copied.
+
+    python related.py     # (re)build the index
+"""
+import os
+import re
+import json
+import math
+import fcntl
+import time
+import shutil
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from sqlalchemy import text
+from models import db
+
+TOP_K = 5
+REBUILD_DELTA = 500
+CACHE_POSTS = 4096
+BUILD_CHUNK = 2000
+# A build lock older than this is left over from a crashed process
+STALE_BUILD_LOCK = 600
+
+TURKISH_STOPWORDS = frozenset("""
+acaba ama ancak artık aslında az bana bazen bazı belki ben beni benim beri bile bir biraz biri birkaç
+birşey biz bize bizi bizim bu buna bunda bundan bunlar bunları bunların bunu bunun burada böyle çok
+çünkü da daha dahi de defa değil diğer diye dolayı en fakat falan gibi hem hep hepsi her hiç için ile
+ise işte kadar ki kim kimse mi mı mu mü nasıl ne neden nerde nerede nereye niye niçin o olan olarak
+oldu olduğu olmak olsa on ona ondan onlar onları onların onu onun orada öyle pek rağmen sadece sanki
+siz size sizi sizin şey şu şuna şunda şundan şunu tabi tüm ve veya ya yani yine yok zaten var çok
+ile bile gibi kez şimdi sonra önce hala hâlâ yada veyahut ayrıca üzere göre kendi kendine bazıları
+""".split())
+
+_WORD_RE = re.compile(r"[^\W\d_]{2,}")
+
+
+def turkish_lower(value):
+    return value.replace('I', 'ı').replace('İ', 'i').lower()
+
+
+def tokenize(value):
+    return [w for w in _WORD_RE.findall(turkish_lower(value or '')) if w not in TURKISH_STOPWORDS]
+
+
+def term_counts(title, content):
+    # Title words count twice, they say more about the topic
+    return Counter(tokenize(title) * 2 + tokenize(content))
+
+
+class RelatedIndex:
+    def __init__(self, root=None):
+        self.root = root
+        self._lock = threading.RLock()
+        self._gen = None
+        self._delta_offset = 0
+        self._cache = OrderedDict()
+        self._building = False
+        self._reset_segments()
+
+    def init_app(self, app):
+        self.root = os.path.join(app.instance_path, 'related_index')
+        os.makedirs(self.root, exist_ok=True)
+        self._app = app
+
+    # --------------------
+    # LOADING
+    # --------------------
+
+    def _reset_segments(self):
+        self.vocab = {}
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.n_docs = 0
+        self.max_post_id = 0
+        self._row_of = {}
+        self.delta = {}        # post_id -> {term: weight}, normalized
+        self.tombstones = set()
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _current_gen(self):
+        try:
+            with open(self._path('CURRENT')) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _load_base(self, gen):
+        base = self._path(f'gen-{gen}')
+        with open(os.path.join(base, 'meta.json')) as f:
+            meta = json.load(f)
+        with open(os.path.join(base, 'vocab.json'), encoding='utf-8') as f:
+            terms = json.load(f)
+
+        self._reset_segments()
+        load = lambda name: np.load(os.path.join(base, name + '.npy'), mmap_mode='r')
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        self.idf = np.array(load('idf'))
+        self.doc_ids = load('doc_ids')
+        self.term_ptr, self.term_docs, self.term_weights = load('term_ptr'), load('term_docs'), load('term_weights')
+        self.doc_ptr, self.doc_terms, self.doc_weights = load('doc_ptr'), load('doc_terms'), load('doc_weights')
+        self.n_docs = meta['n_docs']
+        self.max_post_id = meta['max_post_id']
+        self._row_of = {int(pid): row for row, pid in enumerate(self.doc_ids)}
+        self._gen = gen
+        self._delta_offset = 0
+        self._cache.clear()
+
+    def _weigh(self, counts):
+        """Sublinear tf * base idf, L2-normalized. Unknown terms get the max idf."""
+        default_idf = math.log((1 + self.n_docs) / 1) + 1
+        weights = {}
+        for term, tf in counts.items():
+            i = self.vocab.get(term)
+            idf = float(self.idf[i]) if i is not None else default_idf
+            weights[term] = (1 + math.log(tf)) * idf
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {t: w / norm for t, w in weights.items()}
+
+    def _replay_delta(self):
+        path = self._path(f'delta-{self._gen}.jsonl')
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size <= self._delta_offset:
+            return
+        with open(path, 'rb') as f:
+            f.seek(self._delta_offset)
+            data = f.read()
+        # Only consume complete lines
+        end = data.rfind(b'\n') + 1
+        for raw in data[:end].splitlines():
+            entry = json.loads(raw)
+            if entry['op'] == 'add':
+                self.delta[entry['id']] = self._weigh(entry['tf'])
+                self.tombstones.discard(entry['id'])
+            else:
+                self.delta.pop(entry['id'], None)
+                self.tombstones.add(entry['id'])
+        self._delta_offset += end
+        self._cache.clear()
+
+    def _refresh(self):
+        gen = self._current_gen()
+        if gen is None:
+            return False
+        if gen != self._gen:
+            self._load_base(gen)
+        self._replay_delta()
+        return True
+
+    # --------------------
+    # UPDATES
+    # --------------------
+
+    @contextmanager
+    def _delta_lock(self, mode):
+        # flock, not self._lock: appends and builds happen in every worker
+        fd = os.open(self._path('.delta.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, mode)
+            yield
+        finally:
+            os.close(fd)
+
+    def _append(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        # CURRENT is read under the lock, so a build can't switch it between
+        # the read and the write
+        with self._delta_lock(fcntl.LOCK_SH):
+            gen = self._current_gen()
+            if gen is None:
+                return
+            fd = os.open(self._path(f'delta-{gen}.jsonl'), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def add_post(self, post):
+        with self._lock:
+            if not self._refresh():
+                self.rebuild_async()
+                return
+            self._append({'op': 'add', 'id': post.id, 'tf': term_counts(post.title, post.content)})
+            self._replay_delta()
+            if len(self.delta) + len(self.tombstones) > REBUILD_DELTA:
+                self.rebuild_async()
+
+    def remove_post(self, post_id):
+        with self._lock:
+            if not self._refresh():
+                return
+            self._append({'op': 'del', 'id': post_id})
+            self._replay_delta()
+
+    # --------------------
+    # QUERY
+    # --------------------
+
+    def _vector(self, post_id):
+        if post_id in self.delta:
+            return self.delta[post_id]
+        row = self._row_of.get(post_id)
+        if row is None or post_id in self.tombstones:
+            return None
+        s, e = int(self.doc_ptr[row]), int(self.doc_ptr[row + 1])
+        terms = self.doc_terms[s:e]
+        weights = self.doc_weights[s:e]
+        inverse = self._terms_by_id()
+        return {inverse[int(t)]: float(w) for t, w in zip(terms, weights)}
+
+    def _terms_by_id(self):
+        if getattr(self, '_inverse_gen', None) != self._gen:
+            self._inverse = [None] * len(self.vocab)
+            for t, i in self.vocab.items():
+                self._inverse[i] = t
+            self._inverse_gen = self._gen
+        return self._inverse
+
+    def related(self, post_id, k=TOP_K):
+        """Ids of the k most similar posts, best first."""
+        with self._lock:
+            if not self._refresh():
+                self.rebuild_async()
+                return []
+            cached = self._cache.get(post_id)
+            if cached is not None:
+                self._cache.move_to_end(post_id)
+                return cached[:k]
+
+            query = self._vector(post_id)
+            if not query:
+                return []
+
+            scores = np.zeros(self.n_docs, dtype=np.float32)
+            for term, w in query.items():
+                t = self.vocab.get(term)
+                if t is None:
+                    continue
+                s, e = int(self.term_ptr[t]), int(self.term_ptr[t + 1])
+                # A term lists each doc once, so fancy-index += is safe
+                scores[self.term_docs[s:e]] += w * self.term_weights[s:e]
+
+            # Base rows replaced by a delta entry, removed, or the post itself
+            masked = [self._row_of[p] for p in (self.tombstones | set(self.delta) | {post_id}) if p in self._row_of]
+            if masked:
+                scores[masked] = 0
+
+            candidates = []
+            if self.n_docs:
+                top = min(k * 2, self.n_docs)
+                rows = np.argpartition(-scores, top - 1)[:top]
+                candidates = [(float(scores[r]), int(self.doc_ids[r])) for r in rows if scores[r] > 0]
+            for other_id, vec in self.delta.items():
+                if other_id == post_id:
+                    continue
+                score = sum(w * vec.get(t, 0.0) for t, w in query.items())
+                if score > 0:
+                    candidates.append((score, other_id))
+
+            candidates.sort(reverse=True)
+            result = [pid for _, pid in candidates[:max(k, TOP_K)]]
+            self._cache[post_id] = result
+            while len(self._cache) > CACHE_POSTS:
+                self._cache.popitem(last=False)
+            return result[:k]
+
+    # --------------------
+    # BUILD
+    # --------------------
+
+    def build(self):
+        """Builds a new generation from the post table and makes it current."""
+        docs, df = [], Counter()
+        last, max_post_id = 0, 0
+        while True:
+            with db.engine.connect() as conn:
+                rows = conn.execute(text(
+                    "SELECT id, title, content FROM post WHERE id > :last ORDER BY id LIMIT :n"
+                ), {'last': last, 'n': BUILD_CHUNK}).all()
+            if not rows:
+                break
+            for post_id, title, content in rows:
+                counts = term_counts(title, content)
+                docs.append((post_id, counts))
+                df.update(counts.keys())
+            last = max_post_id = rows[-1][0]
+
+        terms = sorted(df)
+        vocab = {t: i for i, t in enumerate(terms)}
+        n_docs = len(docs)
+        idf = np.array([math.log((1 + n_docs) / (1 + df[t])) + 1 for t in terms], dtype=np.float32)
+
+        doc_ptr = np.zeros(n_docs + 1, dtype=np.int64)
+        doc_terms, doc_weights = [], []
+        for row, (_, counts) in enumerate(docs):
+            ids = np.array([vocab[t] for t in counts], dtype=np.int32)
+            tf = np.array(list(counts.values()), dtype=np.float32)
+            w = (1 + np.log(tf)) * idf[ids]
+            w /= np.linalg.norm(w) or 1.0
+            order = np.argsort(ids)
+            doc_terms.append(ids[order])
+            doc_weights.append(w[order].astype(np.float32))
+            doc_ptr[row + 1] = doc_ptr[row] + len(ids)
+        doc_terms = np.concatenate(doc_terms) if doc_terms else np.zeros(0, dtype=np.int32)
+        doc_weights = np.concatenate(doc_weights) if doc_weights else np.zeros(0, dtype=np.float32)
+
+        # Transpose to the inverted (term -> docs) layout
+        doc_rows = np.repeat(np.arange(n_docs, dtype=np.int32), np.diff(doc_ptr))
+        order = np.argsort(doc_terms, kind='stable')
+        term_docs = doc_rows[order]
+        term_weights = doc_weights[order]
+        term_ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(doc_terms, minlength=len(terms)), out=term_ptr[1:])
+
+        old_gen = self._current_gen()
+        gen = (old_gen or 0) + 1
+        tmp = self._path(f'.gen-{gen}.tmp')
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        arrays = {
+            'doc_ids': np.array([d[0] for d in docs], dtype=np.int64), 'idf': idf,
+            'doc_ptr': doc_ptr, 'doc_terms': doc_terms, 'doc_weights': doc_weights,
+            'term_ptr': term_ptr, 'term_docs': term_docs, 'term_weights': term_weights,
+        }
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'), arr)
+        with open(os.path.join(tmp, 'vocab.json'), 'w', encoding='utf-8') as f:
+            json.dump(terms, f, ensure_ascii=False)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'n_docs': n_docs, 'max_post_id': max_post_id}, f)
+        os.replace(tmp, self._path(f'gen-{gen}'))
+
+        with self._delta_lock(fcntl.LOCK_EX):
+            # Changes logged while we were reading carry over to the new delta:
+            # posts newer than the snapshot, and removals of posts it still has.
+            # Appends wait for the lock, so the old delta is complete here.
+            if old_gen is not None:
+                built_ids = set(arrays['doc_ids'].tolist())
+                carried = []
+                try:
+                    with open(self._path(f'delta-{old_gen}.jsonl'), 'rb') as f:
+                        for raw in f:
+                            if not raw.endswith(b'\n'):
+                                break
+                            entry = json.loads(raw)
+                            if entry['id'] > max_post_id or (entry['op'] == 'del' and entry['id'] in built_ids):
+                                carried.append(raw)
+                except OSError:
+                    pass
+                with open(self._path(f'delta-{gen}.jsonl'), 'wb') as f:
+                    f.writelines(carried)
+
+            tmp_current = self._path('.CURRENT.tmp')
+            with open(tmp_current, 'w') as f:
+                f.write(str(gen))
+            os.replace(tmp_current, self._path('CURRENT'))
+
+        # Keep the previous generation for workers that still have it mapped
+        for name in os.listdir(self.root):
+            if name.startswith(('gen-', 'delta-')):
+                n = int(name.split('-')[1].split('.')[0])
+                if n < gen - 1:
+                    target = self._path(name)
+                    shutil.rmtree(target, ignore_errors=True) if os.path.isdir(target) else os.remove(target)
+        return gen
+
+    def ensure_built(self):
+        if self._current_gen() is None:
+            self.build()
+
+    def rebuild_async(self):
+        """Rebuild in a daemon thread; a lock file keeps it to one process."""
+        if self._building:
+            return
+        lock_path = self._path('.building')
+        try:
+            if time.time() - os.path.getmtime(lock_path) > STALE_BUILD_LOCK:
+                os.remove(lock_path)
+        except OSError:
+            pass
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return
+        os.close(fd)
+        self._building = True
+        app = self._app
+
+        def run():
+            try:
+                with app.app_context():
+                    self.build()
+            finally:
+                self._building = False
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+
+        threading.Thread(target=run, name='related-index-build', daemon=True).start()
+
+
+related_index = RelatedIndex()
+
+
+if __name__ == '__main__':
+    from app import create_app
+    app = create_app({'WARM_STARTUP': False})
+    with app.app_context():
+        print(f"Related-posts index generation {related_index.build()} built.")
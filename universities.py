@@ -0,0 +1,204 @@
+"""
+University directory: Turkish-folded matching of free-text university
+names, clustering of existing values, and an in-memory prefix trie for
+autocomplete.
+
+"ODTÜ", "odtu" and "Orta Doğu Teknik Üniversitesi" fold to the same
+University: names are compared without diacritics or the word
+"üniversitesi", and short single-word values are tried as acronyms of the
+full names.
+"""
+import re
+import time
+import threading
+from sqlalchemy import text
+from models import db, University
+from related import turkish_lower
+
+_FOLD = str.maketrans('çğıöşüâîû', 'cgiosuaiu')
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+# Anything after these is the department ("ODTÜ - Bilgisayar Müh.")
+_DEPARTMENT_SPLIT = re.compile(r"\s[-–/]\s|[,(]")
+UNIVERSITY_WORDS = {'universitesi', 'universite', 'university', 'univ', 'uni', 'u'}
+
+AUTOCOMPLETE_LIMIT = 8
+TRIE_TTL = 300  # seconds; picks up universities created by other workers
+
+
+def fold(value):
+    """Lowercase, ASCII-folded words: 'Orta Doğu Teknik Ü.' -> 'orta dogu teknik u'."""
+    return _NON_WORD.sub(' ', turkish_lower(value or '').translate(_FOLD)).strip()
+
+
+def university_part(value):
+    return _DEPARTMENT_SPLIT.split(value or '', 1)[0].strip()
+
+
+def slugify(value):
+    """Matching key: folded name without the 'university' words."""
+    words = [w for w in fold(university_part(value)).split() if w not in UNIVERSITY_WORDS]
+    return ' '.join(words)
+
+
+def acronym(value):
+    """Turkish-style acronym of a full name: 'Orta Doğu Teknik Üniversitesi' -> 'odtu'."""
+    core = slugify(value).split()
+    if len(core) < 2:
+        return None
+    return ''.join(w[0] for w in core) + 'u'
+
+
+def _acronym_keys(slug):
+    # "odtu" and "odt" both abbreviate Orta Doğu Teknik (Üniversitesi)
+    return [slug, slug + 'u']
+
+
+def _acronym_candidate(slug):
+    return ' ' not in slug and 2 <= len(slug) <= 6
+
+
+def cluster(values):
+    """
+    Groups raw free-text values that name the same university.
+
+    values: {raw value: user count}. Returns a list of (display name,
+    slug, [raw values]), largest groups first.
+    """
+    groups = {}
+    for raw, count in values.items():
+        slug = slugify(raw)
+        if slug:
+            groups.setdefault(slug, {})[raw] = count
+
+    # Fold acronym-only groups ("odtu") into the full name they abbreviate
+    by_acronym = {}
+    for slug, members in groups.items():
+        acr = acronym(slug)
+        if acr:
+            by_acronym.setdefault(acr, []).append(slug)
+    for slug in [s for s in groups if _acronym_candidate(s)]:
+        targets = [t for key in _acronym_keys(slug) for t in by_acronym.get(key, [])]
+        if len(targets) == 1:  # ambiguous acronyms stay separate
+            groups[targets[0]].update(groups.pop(slug))
+
+    result = []
+    for slug, members in groups.items():
+        full = [raw for raw in members if slugify(raw) == slug] or list(members)
+        name = max(full, key=lambda raw: (members[raw], len(university_part(raw))))
+        result.append((university_part(name), slug, sorted(members)))
+    result.sort(key=lambda g: (-sum(groups[g[1]].values()), g[1]))
+    return result
+
+
+def resolve(value, create=True):
+    """University for a free-text value, created if unknown (and create=True)."""
+    slug = slugify(value)
+    if not slug:
+        return None
+    uni = University.query.filter_by(slug=slug).first()
+    if uni is None and _acronym_candidate(slug):
+        matches = University.query.filter(University.acronym.in_(_acronym_keys(slug))).limit(2).all()
+        if len(matches) == 1:
+            uni = matches[0]
+    acr = acronym(value)
+    if uni is None and acr:
+        # Someone typed "ODTÜ" before anyone typed the full name: that row
+        # becomes the full-name entry.
+        uni = University.query.filter(University.slug.in_([acr, acr[:-1]]),
+                                      University.acronym.is_(None)).first()
+        if uni is not None and create:
+            # Another request may have created the full-name row meanwhile;
+            # then that row wins and this one stays as it is.
+            renamed = db.session.execute(text(
+                "UPDATE university SET name = :name, slug = :slug, acronym = :acronym "
+                "WHERE id = :id AND NOT EXISTS (SELECT 1 FROM university WHERE slug = :slug)"
+            ), {'id': uni.id, 'name': university_part(value), 'slug': slug, 'acronym': acr}).rowcount
+            if renamed:
+                db.session.refresh(uni)
+                directory.invalidate()
+            else:
+                uni = University.query.filter_by(slug=slug).first()
+    if uni is None and create:
+        # Check-then-insert races with a concurrent registration naming the
+        # same new university: let the unique slug decide, then re-select.
+        inserted = db.session.execute(text(
+            "INSERT INTO university (name, slug, acronym, created_at) "
+            "VALUES (:name, :slug, :acronym, CURRENT_TIMESTAMP) ON CONFLICT(slug) DO NOTHING"
+        ), {'name': university_part(value), 'slug': slug, 'acronym': acr}).rowcount
+        uni = University.query.filter_by(slug=slug).first()
+        if inserted:
+            directory.invalidate()
+    return uni
+
+
+class _Node:
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.top = []
+
+
+class UniversityDirectory:
+    """
+    Prefix trie over folded names, word starts and acronyms. Each node
+    keeps its own top-k (by user count) so a lookup is one walk down the
+    query, independent of how many universities match.
+    """
+
+    def __init__(self, limit=AUTOCOMPLETE_LIMIT, ttl=TRIE_TTL):
+        self.limit = limit
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._root = _Node()
+        self._built_at = None
+
+    def invalidate(self):
+        self._built_at = None
+
+    def _insert(self, root, key, entry):
+        node = root
+        for ch in key:
+            node = node.children.setdefault(ch, _Node())
+            top = node.top
+            if entry not in top:
+                top.append(entry)
+                top.sort(key=lambda e: (-e[0], e[2]))
+                del top[self.limit:]
+
+    def build(self):
+        with db.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT u.id, u.name, u.acronym, COUNT(usr.id) FROM university u "
+                "LEFT JOIN user usr ON usr.university_id = u.id GROUP BY u.id"
+            )).all()
+        root = _Node()
+        for uni_id, name, acr, users in rows:
+            entry = (users, uni_id, name)
+            words = fold(name).split()
+            keys = {' '.join(words[i:]) for i in range(len(words))}
+            if acr:
+                keys.add(acr)
+            for key in keys:
+                self._insert(root, key, entry)
+        self._root = root
+        self._built_at = time.monotonic()
+
+    def search(self, query):
+        """[(id, name)] for the best matches of a typed prefix."""
+        if self._built_at is None or time.monotonic() - self._built_at > self.ttl:
+            with self._lock:
+                if self._built_at is None or time.monotonic() - self._built_at > self.ttl:
+                    self.build()
+        key = ' '.join(fold(query).split())
+        if not key:
+            return []
+        node = self._root
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return [(uni_id, name) for _, uni_id, name in node.top]
+
+
+directory = UniversityDirectory()
@@ -1,3 +1,4 @@
+import re
 
 # List of prohibited words (Turkish and English)
 # This is a basic list. In a real app, this would be much more extensive or use an external library.
@@ -12,6 +13,10 @@ BAD_WORDS = [
     "whore", "slut", "faggot", "cock", "suck", "motherfucker", "idiot", "stupid", "retard"
 ]
 
+# Single alternation, longest words first; compiled once at import so
+# preloaded gunicorn workers share it.
+_PROFANITY_RE = re.compile('|'.join(re.escape(w) for w in sorted(BAD_WORDS, key=len, reverse=True)))
+
 def contains_profanity(text):
     """
     Checks if the given text contains any prohibited words.
@@ -20,17 +25,9 @@ def contains_profanity(text):
     if not text:
         return False
         
-    text_lower = text.lower()
-    
-    # Check for exact words or words embedded (careful with embedded for short words)
-    # For now, let's do simple inclusion check but slightly smarter
-    
-    for word in BAD_WORDS:
-        # Check if the bad word is in the text
-        if word in text_lower:
-            return True
-            
-    return False
+    # Same substring semantics as checking each word in the lowered text,
+    # but in one pass over the text.
+    return _PROFANITY_RE.search(text.lower()) is not None
 
 def clean_text(text):
     """
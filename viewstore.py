@@ -0,0 +1,374 @@
+"""
+Compact unique-viewer tracking.
+
+Each post keeps one PostViewers row: a compressed bitmap of viewer user ids
+(exact dedupe) and an optional HyperLogLog sketch (approximate counts that
+can be merged across posts). Bitmaps are cached per worker, so a repeat
+"has this user viewed this post" is answered from memory.
+"""
+import sys
+import math
+import zlib
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from sqlalchemy import text, bindparam
+from models import db
+import analytics
+
+# Posts whose bitmaps stay cached per worker
+CACHE_POSTS = 2048
+# Maintain the HyperLogLog sketch next to the exact bitmap
+KEEP_SKETCH = True
+# Optimistic-lock retries when another worker updated the same post
+MAX_RETRIES = 5
+
+
+# --------------------
+# BITMAP
+# --------------------
+
+class ViewerBitmap:
+    """
+    Roaring-style set of user ids. Ids are split into a 16-bit high key and
+    a 16-bit low part; each high key holds a sorted array('H') while sparse,
+    and switches to a plain 8KB bitmap once it passes ARRAY_MAX entries.
+    """
+    ARRAY_MAX = 4096
+    BITMAP_BYTES = 8192
+    MAGIC = b'VB1'
+    _ARRAY, _BITMAP = 0, 1
+
+    def __init__(self):
+        self._containers = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, uid):
+        c = self._containers.get(uid >> 16)
+        if c is None:
+            return False
+        lo = uid & 0xFFFF
+        if isinstance(c, bytearray):
+            return bool(c[lo >> 3] & (1 << (lo & 7)))
+        i = bisect_left(c, lo)
+        return i < len(c) and c[i] == lo
+
+    def __iter__(self):
+        for hi in sorted(self._containers):
+            c = self._containers[hi]
+            base = hi << 16
+            if isinstance(c, bytearray):
+                for byte_index, byte in enumerate(c):
+                    while byte:
+                        low_bit = byte & -byte
+                        yield base + (byte_index << 3) + low_bit.bit_length() - 1
+                        byte ^= low_bit
+            else:
+                for lo in c:
+                    yield base + lo
+
+    def add(self, uid):
+        """Adds uid, returns True if it was not present."""
+        hi, lo = uid >> 16, uid & 0xFFFF
+        c = self._containers.get(hi)
+        if c is None:
+            self._containers[hi] = array('H', [lo])
+        elif isinstance(c, bytearray):
+            bit = 1 << (lo & 7)
+            if c[lo >> 3] & bit:
+                return False
+            c[lo >> 3] |= bit
+        else:
+            i = bisect_left(c, lo)
+            if i < len(c) and c[i] == lo:
+                return False
+            c.insert(i, lo)
+            if len(c) > self.ARRAY_MAX:
+                self._containers[hi] = self._to_bitmap(c)
+        self._count += 1
+        return True
+
+    def discard(self, uid):
+        """Removes uid, returns True if it was present."""
+        hi, lo = uid >> 16, uid & 0xFFFF
+        c = self._containers.get(hi)
+        if c is None:
+            return False
+        if isinstance(c, bytearray):
+            bit = 1 << (lo & 7)
+            if not c[lo >> 3] & bit:
+                return False
+            c[lo >> 3] &= ~bit & 0xFF
+        else:
+            i = bisect_left(c, lo)
+            if i >= len(c) or c[i] != lo:
+                return False
+            del c[i]
+            if not c:
+                del self._containers[hi]
+        self._count -= 1
+        return True
+
+    def copy(self):
+        clone = ViewerBitmap()
+        clone._containers = {
+            hi: (bytearray(c) if isinstance(c, bytearray) else array('H', c))
+            for hi, c in self._containers.items()
+        }
+        clone._count = self._count
+        return clone
+
+    def _to_bitmap(self, values):
+        bitmap = bytearray(self.BITMAP_BYTES)
+        for lo in values:
+            bitmap[lo >> 3] |= 1 << (lo & 7)
+        return bitmap
+
+    def to_bytes(self):
+        parts = [self.MAGIC]
+        for hi in sorted(self._containers):
+            c = self._containers[hi]
+            if isinstance(c, bytearray):
+                payload = bytes(c)
+                parts.append(struct.pack('<IBI', hi, self._BITMAP, len(payload)))
+            else:
+                if sys.byteorder != 'little':
+                    c = array('H', c)
+                    c.byteswap()
+                payload = c.tobytes()
+                parts.append(struct.pack('<IBI', hi, self._ARRAY, len(payload)))
+            parts.append(payload)
+        return zlib.compress(b''.join(parts))
+
+    @classmethod
+    def from_bytes(cls, blob):
+        bm = cls()
+        if not blob:
+            return bm
+        raw = zlib.decompress(blob)
+        if raw[:3] != cls.MAGIC:
+            raise ValueError("Not a viewer bitmap")
+        pos = 3
+        header = struct.Struct('<IBI')
+        while pos < len(raw):
+            hi, kind, length = header.unpack_from(raw, pos)
+            pos += header.size
+            payload = raw[pos:pos + length]
+            pos += length
+            if kind == cls._BITMAP:
+                c = bytearray(payload)
+                bm._count += int.from_bytes(c, 'little').bit_count()
+            else:
+                c = array('H')
+                c.frombytes(payload)
+                if sys.byteorder != 'little':
+                    c.byteswap()
+                bm._count += len(c)
+            bm._containers[hi] = c
+        return bm
+
+
+# --------------------
+# HYPERLOGLOG
+# --------------------
+
+class HyperLogLog:
+    """Approximate distinct counter, ~3% error with the default 1024 registers."""
+
+    def __init__(self, p=10, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers else bytearray(self.m)
+
+    def add(self, uid):
+        h = int.from_bytes(hashlib.blake2b(uid.to_bytes(8, 'little'), digest_size=8).digest(), 'little')
+        idx = h & (self.m - 1)
+        rank = (64 - self.p) - (h >> self.p).bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        for i, r in enumerate(other.registers):
+            if r > self.registers[i]:
+                self.registers[i] = r
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Linear counting for small cardinalities
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes([self.p]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        if not blob:
+            return cls()
+        return cls(p=blob[0], registers=blob[1:])
+
+
+# --------------------
+# STORE
+# --------------------
+
+class ViewStore:
+    def __init__(self, max_posts=CACHE_POSTS):
+        self.max_posts = max_posts
+        self._cache = OrderedDict()  # post_id -> (version, ViewerBitmap)
+
+    def _remember(self, post_id, version, bitmap):
+        self._cache[post_id] = (version, bitmap)
+        self._cache.move_to_end(post_id)
+        while len(self._cache) > self.max_posts:
+            self._cache.popitem(last=False)
+
+    def _load(self, post_id):
+        row = db.session.execute(
+            text("SELECT version, bitmap, sketch FROM post_viewers WHERE post_id = :pid"),
+            {'pid': post_id}
+        ).first()
+        if row is None:
+            return None
+        cached = self._cache.get(post_id)
+        if cached and cached[0] == row.version:
+            bitmap = cached[1]
+        else:
+            bitmap = ViewerBitmap.from_bytes(row.bitmap)
+        self._remember(post_id, row.version, bitmap)
+        return row.version, bitmap, row.sketch
+
+    def has_viewed(self, post_id, user_id):
+        """Memory first; falls back to the stored bitmap on a miss."""
+        cached = self._cache.get(post_id)
+        if cached and user_id in cached[1]:
+            self._cache.move_to_end(post_id)
+            return True
+        loaded = self._load(post_id)
+        return bool(loaded and user_id in loaded[1])
+
+    def viewer_count(self, post_id):
+        loaded = self._load(post_id)
+        return len(loaded[1]) if loaded else 0
+
+    def record_view(self, post, user_id):
+        """
+        Counts a view of `post` by `user_id` if it is the first one.
+        Commits its own short transaction (bitmap, post.view_count and the
+        hourly analytics bucket) and returns True when the view was new.
+        """
+        cached = self._cache.get(post.id)
+        if cached and user_id in cached[1]:
+            self._cache.move_to_end(post.id)
+            return False
+
+        for _ in range(MAX_RETRIES):
+            loaded = self._load(post.id)
+            if loaded is None:
+                version, bitmap, sketch_blob = 0, ViewerBitmap(), None
+            else:
+                version, bitmap, sketch_blob = loaded
+                if user_id in bitmap:
+                    return False
+
+            # Work on a copy so a lost race leaves the cached bitmap untouched
+            updated = bitmap.copy()
+            updated.add(user_id)
+            sketch = None
+            if KEEP_SKETCH:
+                hll = HyperLogLog.from_bytes(sketch_blob)
+                hll.add(user_id)
+                sketch = hll.to_bytes()
+
+            params = {
+                'pid': post.id, 'bitmap': updated.to_bytes(), 'sketch': sketch,
+                'count': len(updated), 'version': version,
+            }
+            if version == 0:
+                result = db.session.execute(text(
+                    "INSERT OR IGNORE INTO post_viewers (post_id, bitmap, sketch, viewer_count, version, updated_at) "
+                    "VALUES (:pid, :bitmap, :sketch, :count, 1, CURRENT_TIMESTAMP)"
+                ), params)
+            else:
+                result = db.session.execute(text(
+                    "UPDATE post_viewers SET bitmap = :bitmap, sketch = :sketch, viewer_count = :count, "
+                    "version = version + 1, updated_at = CURRENT_TIMESTAMP "
+                    "WHERE post_id = :pid AND version = :version"
+                ), params)
+
+            if result.rowcount != 1:
+                # Another worker got there first, re-read and try again
+                db.session.rollback()
+                continue
+
+            db.session.execute(
+                text("UPDATE post SET view_count = COALESCE(view_count, 0) + 1 WHERE id = :pid"),
+                {'pid': post.id}
+            )
+            analytics.record_view(post.id)
+            db.session.commit()
+            self._remember(post.id, version + 1, updated)
+            return True
+        return False
+
+    def viewed_post_ids(self, user_id, chunk=500):
+        """Yields ids of posts `user_id` has viewed, scanning bitmaps in chunks."""
+        last = 0
+        while True:
+            # Short read per chunk, callers may be streaming a response
+            with db.engine.connect() as conn:
+                rows = conn.execute(text(
+                    "SELECT post_id, bitmap FROM post_viewers WHERE post_id > :last "
+                    "ORDER BY post_id LIMIT :chunk"
+                ), {'last': last, 'chunk': chunk}).all()
+            if not rows:
+                return
+            for post_id, blob in rows:
+                if user_id in ViewerBitmap.from_bytes(blob):
+                    yield post_id
+            last = rows[-1][0]
+
+    def forget_user(self, user_id):
+        """Drops a user from every bitmap, e.g. on account deletion."""
+        for post_id in list(self.viewed_post_ids(user_id)):
+            for _ in range(MAX_RETRIES):
+                loaded = self._load(post_id)
+                if loaded is None:
+                    break  # row deleted meanwhile (post removed), nothing to drop
+                version, bitmap, _sketch = loaded
+                updated = bitmap.copy()
+                updated.discard(user_id)
+                result = db.session.execute(text(
+                    "UPDATE post_viewers SET bitmap = :bitmap, viewer_count = :count, "
+                    "version = version + 1 WHERE post_id = :pid AND version = :version"
+                ), {'pid': post_id, 'bitmap': updated.to_bytes(), 'count': len(updated), 'version': version})
+                if result.rowcount == 1:
+                    db.session.commit()
+                    self._remember(post_id, version + 1, updated)
+                    break
+                db.session.rollback()
+
+    def approx_unique_viewers(self, post_ids):
+        """Approximate distinct viewers across several posts from merged sketches."""
+        total = HyperLogLog()
+        if not post_ids:
+            return 0
+        rows = db.session.execute(
+            text("SELECT sketch FROM post_viewers WHERE post_id IN :ids AND sketch IS NOT NULL")
+            .bindparams(bindparam('ids', expanding=True)),
+            {'ids': list(post_ids)}
+        ).all()
+        for (blob,) in rows:
+            total.merge(HyperLogLog.from_bytes(blob))
+        return total.count()
+
+
+store = ViewStore()
@@ -0,0 +1,7 @@
+# gunicorn -c gunicorn.conf.py (wsgi_app = 'wsgi:app')
+#
+# The served app is built here and nowhere else at import time, so scripts
+# that import app.py don't warm up against the production database.
+from app import create_app
+
+app = create_app()